@@ -6,11 +6,21 @@ import torch
 from torch.utils.data.dataloader import DataLoader
 import numpy as np
 
+from .datasets.base import collate_windows_batch
+
 
 class EEGClassifier(NeuralNetClassifier):
     """Classifier that does not assume softmax activation.
     Calls loss function directly without applying log or anything.
+    Batches of datasets that gather many windows at once through
+    __getitems__ are collated with collate_windows_batch, unless another
+    iterator_train__collate_fn or iterator_valid__collate_fn is given.
     """
+    def __init__(self, *args, **kwargs):
+        # collate_windows_batch passes other batches to the default collate
+        kwargs.setdefault('iterator_train__collate_fn', collate_windows_batch)
+        kwargs.setdefault('iterator_valid__collate_fn', collate_windows_batch)
+        super().__init__(*args, **kwargs)
 
     # pylint: disable=arguments-differ
     def get_loss(self, y_pred, y_true, *args, **kwargs):
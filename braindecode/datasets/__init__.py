@@ -1,5 +1,5 @@
 """
 Loader code for some datasets.
 """
-from .base import WindowsDataset, BaseDataset
+from .base import WindowsDataset, BaseDataset, BaseConcatDataset
 from .datasets import MOABBDataset, TUHAbnormal
@@ -9,7 +9,23 @@ Dataset classes.
 #
 # License: BSD (3-clause)
 
-from torch.utils.data import Dataset
+import os
+import json
+from collections.abc import Sequence
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import mne
+import torch
+from torch.utils.data import Dataset, ConcatDataset, Subset
+from torch.utils.data.dataloader import default_collate
+
+from ..datautil.windowers import ArrayWindows, QuantizedSignal
+
+
+_SUPERCROP_IND_KEYS = [
+    'i_supercrop_in_trial', 'i_start_in_trial', 'i_stop_in_trial']
 
 
 class BaseDataset(Dataset):
@@ -21,13 +37,16 @@ class BaseDataset(Dataset):
     raw: mne.Raw
     info: pandas.DataFrame
         holds additional information about the raw
+    target: str | list(str) | None
+        column(s) of info to be used as target(s)
     """
     def __init__(self, raw, info, target=None):
         self.raw = raw
         # TODO: rename
         self.info = info
         if target is not None:
-            assert target in self.info, f"'{target}' not in info"
+            for t in [target] if isinstance(target, str) else target:
+                assert t in self.info, f"'{t}' not in info"
         self.target = target
 
     def __getitem__(self, index):
@@ -43,21 +62,496 @@ class WindowsDataset(BaseDataset):
 
     Parameters
     ----------
-    windows: ConcatDataset
+    windows: mne.Epochs | ArrayWindows
         windows/supercrops obtained throiugh application of a Windower to a
         BaseDataset
     info: pandas.DataFrame
         hold additional info about the windows
+    base_ds: BaseDataset | None
+        the continuous dataset the windows were created from, required to
+        window it again with BaseConcatDataset.rewindow
     """
-    def __init__(self, windows, info):
+    def __init__(self, windows, info, base_ds=None):
         self.windows = windows
         self.info = info
+        self.base_ds = base_ds
+        self._columns = None
+
+    def __getitem__(self, index):
+        targets, ind_columns = self._window_columns()
+        ind = [column[index].item() for column in ind_columns]
+        if isinstance(self.windows, mne.BaseEpochs):
+            X = self.windows[index].get_data().squeeze(0)
+        else:
+            X = self.windows.get_window(index)
+        return X, targets[index], ind
+
+    def __getitems__(self, indices):
+        """Get many windows at once.
+
+        Parameters
+        ----------
+        indices: array-like of int
+            indices of the windows
+
+        Returns
+        -------
+        batch: WindowsBatch
+            windows stacked to shape (n_windows, n_channels, n_times) with
+            their targets and supercrop indices
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        targets, ind_columns = self._window_columns()
+        ind = np.stack([column[indices] for column in ind_columns], axis=1)
+        if isinstance(self.windows, mne.BaseEpochs):
+            X = self.windows[indices].get_data()
+        else:
+            X = self.windows.get_windows(indices)
+        return WindowsBatch(X, targets[indices], ind)
+
+    def _window_columns(self):
+        # targets and supercrop indices as contiguous arrays, such that a
+        # window is looked up without going through pandas
+        if not isinstance(self.windows, mne.BaseEpochs):
+            return self.windows.targets, [
+                self.windows.columns[key] for key in _SUPERCROP_IND_KEYS]
+        # mne.Epochs can drop windows, e.g. when loading data, in which case
+        # the columns are read again
+        if (self._columns is None or
+                len(self._columns[0]) != len(self.windows.events)):
+            metadata = self.windows.metadata
+            self._columns = (
+                np.ascontiguousarray(self.windows.events[:, -1]),
+                [np.ascontiguousarray(metadata[key].to_numpy())
+                 for key in _SUPERCROP_IND_KEYS])
+        return self._columns
+
+    def __len__(self):
+        return len(self.windows.events)
+
+
+class WindowsBatch(Sequence):
+    """
+    A batch of windows gathered at once. Behaves like a list of
+    (X, y, ind) samples, such that the default collate of torch still works,
+    but holds the stacked arrays, which collate_windows_batch turns into
+    tensors without copying.
+
+    Parameters
+    ----------
+    X: ndarray, shape (n_windows, n_channels, n_times)
+        stacked windows
+    y: ndarray, shape (n_windows,)
+        targets of the windows
+    ind: ndarray, shape (n_windows, 3)
+        i_supercrop_in_trial, i_start_in_trial and i_stop_in_trial of the
+        windows
+    """
+    def __init__(self, X, y, ind):
+        self.X = X
+        self.y = y
+        self.ind = ind
 
     def __getitem__(self, index):
-        target = self.windows.events[:,-1]
-        keys = ['i_supercrop_in_trial', 'i_start_in_trial', 'i_stop_in_trial']
-        info = self.windows.metadata.iloc[index][keys].to_list()
-        return self.windows[index].get_data().squeeze(0), target[index], info
+        return self.X[index], self.y[index], self.ind[index].tolist()
 
     def __len__(self):
-        return len(self.windows.events)
\ No newline at end of file
+        return len(self.X)
+
+
+def collate_windows_batch(batch):
+    """Collate a WindowsBatch into tensors X, y and a list of the three
+    supercrop index tensors, as the default collate would for single windows.
+    Any other batch, i.e. a list of samples, is passed to the default
+    collate.
+
+    Parameters
+    ----------
+    batch: WindowsBatch | list
+
+    Returns
+    -------
+    batch: list
+        X, y and supercrop indices as tensors
+    """
+    if not isinstance(batch, WindowsBatch):
+        return default_collate(batch)
+    return [torch.as_tensor(batch.X), torch.as_tensor(batch.y),
+            list(torch.as_tensor(batch.ind).T)]
+
+
+class BaseConcatDataset(ConcatDataset):
+    """
+    A base class for concatenated datasets. Holds BaseDatasets or
+    WindowsDatasets in self.datasets and a pandas DataFrame with additional
+    info about them.
+
+    Parameters
+    ----------
+    list_of_ds: list
+        list of BaseDataset or WindowsDataset to be concatenated
+    info: pandas.DataFrame
+        holds additional info about the datasets, one row per dataset
+    """
+    def __init__(self, list_of_ds, info=None):
+        super().__init__(list_of_ds)
+        self.info = info
+        # flat table of dataset id and index within that dataset of every
+        # window, replacing the bisection of ConcatDataset
+        sizes = np.diff(self.cumulative_sizes, prepend=0)
+        self._dataset_ids = np.repeat(np.arange(len(sizes)), sizes)
+        self._local_ids = np.arange(self.cumulative_sizes[-1]) - np.repeat(
+            self.cumulative_sizes - sizes, sizes)
+
+    def __getitem__(self, index):
+        i_ds = self._dataset_ids[index]
+        return self.datasets[i_ds][self._local_ids[index].item()]
+
+    def split(self, some_property=None, split_ids=None):
+        """Split the dataset based on some property listed in its info DataFrame
+        or based on indices.
+
+        Parameters
+        ----------
+        some_property: str
+            some property which is listed in info DataFrame
+        split_ids: list(int)
+            list of indices to be combined in a subset
+
+        Returns
+        -------
+        splits: dict{split_name: subset}
+            mapping of split name based on property or index based on split_ids
+            to subset of the data
+        """
+        assert split_ids is None or some_property is None, (
+            "can split either based on ids or based on some property")
+        if split_ids is None:
+            split_ids = _split_ids(self.info, some_property)
+        else:
+            split_ids = {split_i: split
+                         for split_i, split in enumerate(split_ids)}
+        # split_ids are indices for WindowsDatasets
+        supercrop_ids = _windows_dataset_ids_to_supercrop_ids(
+            split_ids, self.cumulative_sizes)
+        return {split_name: _ConcatDatasetView(self, split)
+                for split_name, split in supercrop_ids.items()}
+
+    def rewindow(self, windower):
+        """Window the continuous recordings again, e.g. with another
+        supercrop size and stride. ArrayWindows are views of the continuous
+        signals of the recordings, such that all window configurations share
+        the same signals and memory does not grow with their number, unless
+        the windower converts the signals to a storage dtype. Datasets
+        without their continuous recording, i.e. lazily read TUHAbnormal,
+        loaded datasets and windows converted to a storage dtype from
+        preloaded raws, cannot be windowed again.
+
+        Parameters
+        ----------
+        windower: Windower
+            windower applied to the continuous recording of every
+            WindowsDataset
+
+        Returns
+        -------
+        concat_ds: BaseConcatDataset
+            WindowsDatasets of the new windows with the same info
+        """
+        all_windows_ds = []
+        for ds in self.datasets:
+            assert getattr(ds, "base_ds", None) is not None, (
+                "windows datasets have to hold their continuous recording "
+                "(base_ds), which is not available for lazily read "
+                "recordings, loaded datasets and preloaded raws converted to "
+                "a storage dtype")
+            all_windows_ds.append(WindowsDataset(
+                windower(ds.base_ds), ds.info, base_ds=ds.base_ds))
+        return BaseConcatDataset(all_windows_ds, self.info)
+
+    def __getitems__(self, indices):
+        """Get many windows at once, gathering them per dataset.
+
+        Parameters
+        ----------
+        indices: array-like of int
+            indices of the windows in the concatenation
+
+        Returns
+        -------
+        batch: WindowsBatch
+            windows in order of indices
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        i_datasets = self._dataset_ids[indices]
+        local_ids = self._local_ids[indices]
+        # group the positions in the batch by dataset
+        order = np.argsort(i_datasets, kind='stable')
+        groups = np.split(
+            order, np.flatnonzero(np.diff(i_datasets[order])) + 1)
+        batches = [_getitems(self.datasets[i_datasets[positions[0]]],
+                             local_ids[positions]) for positions in groups]
+        if len(batches) == 1:
+            return batches[0]
+        X = np.empty((len(indices),) + batches[0].X.shape[1:],
+                     dtype=np.result_type(*[batch.X for batch in batches]))
+        for positions, batch in zip(groups, batches):
+            X[positions] = batch.X
+        y = np.concatenate([batch.y for batch in batches])
+        ind = np.concatenate([batch.ind for batch in batches])
+        y[order], ind[order] = y.copy(), ind.copy()
+        return WindowsBatch(X, y, ind)
+
+    def save(self, path):
+        """Save windows to a directory. Continuous signals are stored
+        one after another in a flat .npy file per dtype, the window index,
+        targets and window metadata as arrays and info, if given, as a json
+        table, such that the dataset can be loaded memory-mapped.
+
+        Parameters
+        ----------
+        path: str
+            directory to which the dataset is saved
+        """
+        os.makedirs(path, exist_ok=True)
+        # signals shared between windows datasets are only stored once
+        signals, recording_ids = [], {}
+        all_windows_ind, all_events, all_metadata, all_targets = (
+            [], [], [], [])
+        for ds in self.datasets:
+            windows = ds.windows
+            if isinstance(windows, mne.BaseEpochs):
+                # store the windows of mne.Epochs one after another
+                n_windows, n_times = len(windows), len(windows.times)
+                starts = np.arange(n_windows) * n_times
+                windows_ind = np.stack(
+                    [np.zeros(n_windows, dtype=np.int64), starts,
+                     starts + n_times], axis=1)
+                ids = [len(signals)]
+                signals.append(windows)
+            else:
+                windows_ind = windows.windows_ind
+                ids = []
+                for signal in windows.data:
+                    if id(signal) not in recording_ids:
+                        recording_ids[id(signal)] = len(signals)
+                        signals.append(signal)
+                    ids.append(recording_ids[id(signal)])
+            windows_ind = windows_ind.copy()
+            windows_ind[:, 0] = np.asarray(ids)[windows_ind[:, 0]]
+            all_windows_ind.append(windows_ind)
+            all_events.append(windows.events)
+            all_targets.append(
+                windows.events[:, -1] if isinstance(windows, mne.BaseEpochs)
+                else windows.targets)
+            all_metadata.append(windows.metadata)
+
+        signal_descriptions = _save_signals(path, signals)
+        np.save(os.path.join(path, "windows_ind.npy"),
+                np.concatenate(all_windows_ind))
+        np.save(os.path.join(path, "events.npy"), np.concatenate(all_events))
+        np.save(os.path.join(path, "targets.npy"),
+                np.concatenate(all_targets))
+        metadata = pd.concat(all_metadata, ignore_index=True)
+        for column in metadata.columns:
+            np.save(os.path.join(path, f"metadata-{column}.npy"),
+                    metadata[column].to_numpy())
+        np.save(os.path.join(path, "n_windows.npy"),
+                np.array([len(ds) for ds in self.datasets]))
+        info_path = os.path.join(path, "info.json")
+        if self.info is not None:
+            # the table schema keeps the dtypes and index of info
+            with open(info_path, "w") as f:
+                f.write(self.info.to_json(orient="table", date_format="iso"))
+        elif os.path.exists(info_path):
+            os.remove(info_path)
+        with open(os.path.join(path, "description.json"), "w") as f:
+            json.dump({"signals": signal_descriptions,
+                       "metadata_columns": list(metadata.columns)}, f)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """Load windows saved with BaseConcatDataset.save.
+
+        Parameters
+        ----------
+        path: str
+            directory to which the dataset was saved
+        mmap: bool
+            if True, memory-map the signals instead of reading them into
+            memory. Pages are then shared through the page cache, also
+            between DataLoader workers.
+
+        Returns
+        -------
+        concat_ds: BaseConcatDataset
+            concatenation of WindowsDatasets holding ArrayWindows
+        """
+        with open(os.path.join(path, "description.json")) as f:
+            description = json.load(f)
+        info = None
+        info_path = os.path.join(path, "info.json")
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                info = pd.read_json(StringIO(f.read()), orient="table",
+                                    dtype=False, convert_dates=False)
+        signals = _load_signals(path, description["signals"], mmap)
+        windows_ind = np.load(os.path.join(path, "windows_ind.npy"))
+        events = np.load(os.path.join(path, "events.npy"))
+        targets = np.load(os.path.join(path, "targets.npy"))
+        metadata = pd.DataFrame({
+            column: np.load(os.path.join(path, f"metadata-{column}.npy"))
+            for column in description["metadata_columns"]})
+        i_stops = np.cumsum(np.load(os.path.join(path, "n_windows.npy")))
+        i_starts = np.insert(i_stops[:-1], 0, 0)
+        all_windows_ds = []
+        for i_ds, (i_start, i_stop) in enumerate(zip(i_starts, i_stops)):
+            # every dataset only holds the signals of its own windows
+            ds_windows_ind = windows_ind[i_start:i_stop].copy()
+            i_recordings, ds_windows_ind[:, 0] = np.unique(
+                ds_windows_ind[:, 0], return_inverse=True)
+            windows = ArrayWindows(
+                [signals[i] for i in i_recordings], ds_windows_ind,
+                events[i_start:i_stop],
+                metadata.iloc[i_start:i_stop].reset_index(drop=True),
+                targets=targets[i_start:i_stop])
+            all_windows_ds.append(WindowsDataset(
+                windows, None if info is None else info.iloc[[i_ds]]))
+        return BaseConcatDataset(all_windows_ds, info)
+
+
+class _ConcatDatasetView(Subset):
+    """Subset of a BaseConcatDataset given by an index array, that gathers
+    batches without looping over the indices in Python."""
+    def __init__(self, dataset, indices):
+        super().__init__(dataset, np.asarray(indices, dtype=np.int64))
+
+    def __getitem__(self, index):
+        return self.dataset[self.indices[index]]
+
+    def __getitems__(self, indices):
+        return self.dataset.__getitems__(
+            self.indices[np.asarray(indices, dtype=np.int64)])
+
+    @property
+    def cumulative_sizes(self):
+        """Cumulative numbers of windows of the recordings of the view, like
+        ConcatDataset.cumulative_sizes. Windows of a recording are
+        consecutive in views given by BaseConcatDataset.split."""
+        if len(self.indices) == 0:
+            return []
+        i_recordings = np.searchsorted(
+            self.dataset.cumulative_sizes, self.indices, side="right")
+        i_stops = np.flatnonzero(np.diff(i_recordings)) + 1
+        return i_stops.tolist() + [len(self.indices)]
+
+
+def _getitems(ds, indices):
+    if hasattr(ds, '__getitems__'):
+        return ds.__getitems__(indices)
+    X, y, ind = zip(*[ds[i] for i in indices])
+    return WindowsBatch(np.stack(X), np.asarray(y), np.asarray(ind))
+
+
+def _signal_file_path(path, name):
+    return os.path.join(path, f"signals-{name}.npy")
+
+
+def _save_signals(path, signals):
+    """Write signals one after another into one flat file per dtype. Every
+    memory-mapped file keeps a file descriptor open, so a file per signal
+    would exceed the limit of open files for large datasets."""
+    descriptions, sizes = [], {}
+    for i_signal, signal in enumerate(signals):
+        if isinstance(signal, mne.BaseEpochs):
+            dtype = np.dtype(np.float64)
+            shape = (len(signal.ch_names), len(signal) * len(signal.times))
+        else:
+            data = signal.data if isinstance(
+                signal, QuantizedSignal) else signal
+            # lazily read recordings like LazyEDFRecording are read as float64
+            dtype = np.dtype(getattr(data, "dtype", np.float64))
+            shape = data.shape
+        size = int(np.prod(shape))
+        descriptions.append(dict(
+            dtype=dtype.name, offset=sizes.get(dtype.name, 0),
+            shape=list(shape),
+            quantized=isinstance(signal, QuantizedSignal)))
+        sizes[dtype.name] = sizes.get(dtype.name, 0) + size
+    flat_signals = {
+        name: np.lib.format.open_memmap(
+            _signal_file_path(path, name), mode="w+", dtype=name,
+            shape=(size,)) for name, size in sizes.items()}
+    for i_signal, (signal, description) in enumerate(
+            zip(signals, descriptions)):
+        if isinstance(signal, mne.BaseEpochs):
+            data = signal.get_data().transpose(1, 0, 2)
+        elif isinstance(signal, QuantizedSignal):
+            np.save(_signal_file_path(path, f"{i_signal}-scale"),
+                    signal.scale)
+            np.save(_signal_file_path(path, f"{i_signal}-offset"),
+                    signal.offset)
+            data = signal.data
+        elif isinstance(signal, np.ndarray):
+            data = signal
+        else:
+            data = signal[:, :]
+        offset = description["offset"]
+        flat_signal = flat_signals[description["dtype"]][
+            offset:offset + int(np.prod(description["shape"]))]
+        flat_signal.reshape(description["shape"])[:] = np.reshape(
+            data, description["shape"])
+    for flat_signal in flat_signals.values():
+        flat_signal.flush()
+    return descriptions
+
+
+def _load_signals(path, descriptions, mmap):
+    # copy-on-write mapping, so windows are writable without changing the file
+    flat_signals = {
+        name: np.load(_signal_file_path(path, name),
+                      mmap_mode="c" if mmap else None)
+        for name in set(d["dtype"] for d in descriptions)}
+    signals = []
+    for i_signal, description in enumerate(descriptions):
+        offset = description["offset"]
+        signal = flat_signals[description["dtype"]][
+            offset:offset + int(np.prod(description["shape"]))].reshape(
+            description["shape"])
+        if description["quantized"]:
+            signal = QuantizedSignal(
+                signal,
+                np.load(_signal_file_path(path, f"{i_signal}-scale")),
+                np.load(_signal_file_path(path, f"{i_signal}-offset")))
+        signals.append(signal)
+    return signals
+
+
+def _windows_dataset_ids_to_supercrop_ids(dataset_ids, cumulative_sizes):
+    supercrop_ids = {}
+    for split_name, windows_is in dataset_ids.items():
+        this_supercrop_ids = _supercrop_ids_of_windows(
+            cumulative_sizes, windows_is)
+        supercrop_ids[split_name] = this_supercrop_ids
+    return supercrop_ids
+
+
+def _supercrop_ids_of_windows(cumulative_sizes, windows_is):
+    i_stops = np.asarray(cumulative_sizes)
+    i_starts = np.insert(i_stops[:-1], 0, [0])
+    windows_is = np.asarray(windows_is, dtype=np.int64)
+    sizes = i_stops[windows_is] - i_starts[windows_is]
+    # consecutive ranges i_starts[i_window]:i_stops[i_window] of all windows
+    offsets = i_starts[windows_is] - (np.cumsum(sizes) - sizes)
+    return np.repeat(offsets, sizes) + np.arange(sizes.sum())
+
+
+def _split_ids(df, some_property):
+    assert some_property in df
+    # positions of the datasets, as the index of info can hold any labels,
+    # e.g. subject ids after a query
+    df = df.reset_index(drop=True)
+    split_ids = {}
+    for group_name, group in df.groupby(some_property):
+        split_ids.update({group_name: list(group.index)})
+    return split_ids
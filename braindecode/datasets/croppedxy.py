@@ -4,8 +4,10 @@
 # License: BSD-3
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from torch.utils.data import Dataset
 
+from braindecode.datasets.base import WindowsBatch
 from braindecode.datautil.windowers import _supercrop_starts
 
 
@@ -32,41 +34,72 @@ class CroppedXyDataset(Dataset):
         # so we know number of supercrops (length of the dataset)
         # and we can have a mapping:
         # i_supercrop -> i_trial, start, stop
-        i_supercrop_to_idx = []
-        for i_trial, trial in enumerate(X):
-            idx = _supercrop_starts(
-                np.array([0]),
-                0,
-                trial.shape[1],
-                input_time_length,
-                n_preds_per_input,
-                drop_samples=False,
-            )
-            for _, i_supercrop_in_trial, start, stop in zip(*idx):
-                i_supercrop_to_idx.append(
-                    dict(
-                        i_trial=i_trial,
-                        i_supercrop_in_trial=i_supercrop_in_trial,
-                        start=start,
-                        stop=stop,
-                    )
-                )
-        self.i_supercrop_to_idx = i_supercrop_to_idx
+        if isinstance(X, np.ndarray) and X.ndim == 3:
+            trial_lengths = np.full(len(X), X.shape[2])
+        else:
+            trial_lengths = np.array([trial.shape[1] for trial in X])
+        self.i_supercrop_to_idx = _create_supercrop_index(
+            trial_lengths, input_time_length, n_preds_per_input)
+        self._targets = np.asarray(y)
 
     def __len__(self):
         return len(self.i_supercrop_to_idx)
 
     def __getitem__(self, i):
-        supercrop_idx = self.i_supercrop_to_idx[i]
-        X = self.X[
-            supercrop_idx["i_trial"],
-            :,
-            supercrop_idx["start"]: supercrop_idx["stop"],
-            ]
-        y = self.y[supercrop_idx["i_trial"]]
-        returned_idx = (
-            supercrop_idx["i_supercrop_in_trial"],
-            supercrop_idx["start"],
-            supercrop_idx["stop"],
+        i_trial, i_supercrop_in_trial, start, stop = (
+            self.i_supercrop_to_idx[i].item())
+        X = self.X[i_trial][:, start:stop]
+        y = self.y[i_trial]
+        return X, y, (i_supercrop_in_trial, start, stop)
+
+    def __getitems__(self, indices):
+        """Get many supercrops at once as a WindowsBatch."""
+        supercrop_idxs = self.i_supercrop_to_idx[np.asarray(indices)]
+        if (isinstance(self.X, np.ndarray) and self.X.ndim == 3 and
+                len(supercrop_idxs) > 0):
+            # gather all supercrops at once from a view of all supercrops of
+            # the padded array, all supercrops have the same size
+            size = supercrop_idxs["stop"][0] - supercrop_idxs["start"][0]
+            supercrops = sliding_window_view(self.X, size, axis=2)
+            X = supercrops[supercrop_idxs["i_trial"], :,
+                           supercrop_idxs["start"]]
+        else:
+            X = np.stack([
+                self.X[i_trial][:, start:stop]
+                for i_trial, _, start, stop in supercrop_idxs.tolist()])
+        y = self._targets[supercrop_idxs["i_trial"]]
+        ind = np.stack([supercrop_idxs[name].astype(np.int64) for name in
+                        ["i_supercrop_in_trial", "start", "stop"]], axis=1)
+        return WindowsBatch(X, y, ind)
+
+
+_SUPERCROP_INDEX_DTYPE = np.dtype([
+    ("i_trial", np.int32), ("i_supercrop_in_trial", np.int32),
+    ("start", np.int32), ("stop", np.int32)])
+
+
+def _create_supercrop_index(trial_lengths, size, stride):
+    """Create the structured array of i_trial, i_supercrop_in_trial, start
+    and stop of all supercrops, computing supercrop starts once per distinct
+    trial length."""
+    parts = []
+    for trial_length in np.unique(trial_lengths):
+        i_trials_of_length = np.flatnonzero(trial_lengths == trial_length)
+        i_trials, i_supercrop_in_trials, starts, stops = _supercrop_starts(
+            np.zeros(len(i_trials_of_length), dtype=np.int64),
+            0,
+            trial_length,
+            size,
+            stride,
+            drop_samples=False,
         )
-        return X, y, returned_idx
+        part = np.empty(len(starts), dtype=_SUPERCROP_INDEX_DTYPE)
+        part["i_trial"] = i_trials_of_length[i_trials]
+        part["i_supercrop_in_trial"] = i_supercrop_in_trials
+        part["start"] = starts
+        part["stop"] = stops
+        parts.append(part)
+    index = np.concatenate(
+        parts or [np.empty(0, dtype=_SUPERCROP_INDEX_DTYPE)])
+    # stable, so supercrops stay ordered within their trial
+    return index[np.argsort(index["i_trial"], kind="stable")]
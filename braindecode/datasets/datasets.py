@@ -11,14 +11,19 @@ BCI competition IV 2a dataset
 
 import os
 import re
-import glob
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 import mne
 
-from torch.utils.data import ConcatDataset, Subset
-from .base import WindowsDataset, BaseDataset
-from ..datautil.windowers import EventWindower, FixedLengthWindower
+from .base import WindowsDataset, BaseDataset, BaseConcatDataset
+from .edf import (
+    read_edf_headers, EDFReaderCache, LazyEDFRecording, _parse_age_and_gender)
+from ..datautil.windowers import (
+    EventWindower, FixedLengthWindower, _array_windows_from_events)
+from ..util import add_message_to_exception
 
 try:
     from mne import annotations_from_events
@@ -180,10 +185,7 @@ def fetch_data_with_moabb(dataset_name, subject_ids):
     return _fetch_and_unpack_moabb_data(dataset, subject_id)
 
 
-# TODO: EEG / EEGDataset which has a ConcatDataset and additional info
-# TODO: BaseConcatDataset: implement split
-
-class MOABBDataset(ConcatDataset):
+class MOABBDataset(BaseConcatDataset):
     """A class for moabb datasets.
 
     Parameters
@@ -205,6 +207,17 @@ class MOABBDataset(ConcatDataset):
     ignore_events: bool
         when True, ignores events specified in mne.Raw and uses a
         FixedLenthWindower to create supercrops/windows
+    mapping: dict{target_value: int}
+        maps target values to integers
+    use_mne_epochs: bool
+        if False, windows are slices of the preloaded continuous signals
+        instead of mne.Epochs
+    dtype: str | None
+        storage dtype of the continuous signals if use_mne_epochs is False,
+        float32, float16 or int16 with a scale and offset per channel
+    n_jobs: int
+        number of worker processes used to fetch, read and window the
+        recordings of the subjects, -1 uses all cpus
 
     """
     # TODO: include preprocessing at different stages
@@ -212,7 +225,7 @@ class MOABBDataset(ConcatDataset):
             self, dataset_name, subject_ids, trial_start_offset_samples,
             trial_stop_offset_samples, supercrop_size_samples,
             supercrop_stride_samples, drop_samples=False, ignore_events=False,
-            mapping=None):
+            mapping=None, use_mne_epochs=True, dtype=None, n_jobs=1):
         if ignore_events:
             windower = FixedLengthWindower
         else:
@@ -223,77 +236,77 @@ class MOABBDataset(ConcatDataset):
             supercrop_size_samples=supercrop_size_samples,
             supercrop_stride_samples=supercrop_stride_samples,
             drop_samples=drop_samples,
-            mapping=mapping)
-
-        raws, info = fetch_data_with_moabb(dataset_name, subject_ids)
-        all_windows_ds = []
-        for raw_i, raw in enumerate(raws):
-            base_ds = BaseDataset(raw, info.iloc[raw_i])
-            windows = windower(base_ds)
-            windows_ds = WindowsDataset(windows, base_ds.info)
-            all_windows_ds.append(windows_ds)
-        super().__init__(all_windows_ds)
-        self.info = info
-
-    # TODO: remove duplicate code here and in TUHAbnormal
-    # TODO: Create another class 'SpecificDataset'?
-    def split(self, some_property=None, split_ids=None):
-        """Split the dataset based on some property listed in its info DataFrame
-        or based on indices.
-
-        Parameters
-        ----------
-        some_property: str
-            some property which is listed in info DataFrame
-        split_ids: list(int)
-            list of indices to be combined in a subset
-
-        Returns
-        -------
-        splits: dict{split_name: subset}
-            mapping of split name based on property or index based on split_ids
-            to subset of the data
-
-        """
-        assert split_ids is None or some_property is None, (
-            "can split either based on ids or based on some property")
-        if split_ids is None:
-            split_ids = _split_ids(self.info, some_property)
-        else:
-            split_ids = {split_i: split
-                         for split_i, split in enumerate(split_ids)}
-        # split_ids are indices for WindowsDatasets
-        supercrop_ids = _windows_dataset_ids_to_supercrop_ids(
-            split_ids, self.cumulative_sizes)
-        return {split_name: Subset(self, split)
-                for split_name, split in supercrop_ids.items()}
-
-
-def _windows_dataset_ids_to_supercrop_ids(dataset_ids, cumulative_sizes):
-    supercrop_ids = {}
-    for split_name, windows_is in dataset_ids.items():
-        this_supercrop_ids = _supercrop_ids_of_windows(
-            cumulative_sizes, windows_is)
-        supercrop_ids[split_name] = this_supercrop_ids
-    return supercrop_ids
-
-
-def _supercrop_ids_of_windows(cumulative_sizes, windows_is):
-    i_stops = cumulative_sizes
-    i_starts = np.insert(cumulative_sizes[:-1], 0, [0])
-    i_per_window = []
-    for i_window in windows_is:
-        i_per_window.append(list(range(i_starts[i_window], i_stops[i_window])))
-    all_i_windows = np.concatenate(i_per_window)
-    return all_i_windows
-
-
-def _split_ids(df, some_property):
-    assert some_property in df
-    split_ids = {}
-    for group_name, group in df.groupby(some_property):
-        split_ids.update({group_name: list(group.index)})
-    return split_ids
+            mapping=mapping,
+            use_mne_epochs=use_mne_epochs,
+            dtype=dtype)
+
+        if isinstance(subject_ids, int):
+            subject_ids = [subject_ids]
+        # subjects are fetched and read in the workers, such that only the
+        # windows are sent back instead of sending preloaded raws both ways
+        subjects_windows_ds = _map_recordings(
+            _create_moabb_windows_datasets,
+            [(dataset_name, subject_id, windower)
+             for subject_id in subject_ids],
+            names=[f"subject {subject_id}" for subject_id in subject_ids],
+            n_jobs=n_jobs)
+        all_windows_ds = [windows_ds for subject_windows_ds, _ in
+                          subjects_windows_ds
+                          for windows_ds in subject_windows_ds]
+        info = pd.concat([info for _, info in subjects_windows_ds],
+                         ignore_index=True)
+        super().__init__(all_windows_ds, info)
+
+
+def _create_moabb_windows_datasets(dataset_name, subject_id, windower):
+    raws, info = fetch_data_with_moabb(dataset_name, subject_id)
+    return [_create_windows_ds(raw, info.iloc[raw_i], windower)
+            for raw_i, raw in enumerate(raws)], info
+
+
+def _create_windows_ds(raw, info, windower, target=None):
+    base_ds = BaseDataset(raw, info, target=target)
+    windows = windower(base_ds)
+    # windows of a preloaded raw converted to a storage dtype hold a copy of
+    # the signal, keeping the raw would keep its float64 data in memory, too
+    if getattr(windower, "dtype", None) is not None and raw.preload:
+        return WindowsDataset(windows, base_ds.info)
+    return WindowsDataset(windows, base_ds.info, base_ds=base_ds)
+
+
+def _map_recordings(func, list_of_args, names, n_jobs):
+    """Apply func to the arguments of every recording, possibly in n_jobs
+    worker processes. Results are returned in the order of list_of_args.
+    Errors are raised naming the recording that failed.
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs == 1:
+        results = []
+        for args, name in zip(list_of_args, names):
+            try:
+                results.append(func(*args))
+            except Exception as e:
+                add_message_to_exception(e, f" (while processing {name})")
+                raise
+        return results
+
+    executor = ProcessPoolExecutor(max_workers=n_jobs)
+    futures = [executor.submit(func, *args) for args in list_of_args]
+    results = []
+    try:
+        for future, name in zip(futures, names):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # do not wait for pending recordings if one of them failed
+                for pending_future in futures:
+                    pending_future.cancel()
+                add_message_to_exception(e, f" (while processing {name})")
+                raise
+    finally:
+        executor.shutdown(wait=True)
+    return results
 
 
 class BNCI2014001(MOABBDataset):
@@ -308,7 +321,7 @@ class HGD(MOABBDataset):
         super().__init__("Schirrmeister2017", *args, **kwargs)
 
 
-class TUHAbnormal(ConcatDataset):
+class TUHAbnormal(BaseConcatDataset):
     """Temple University Hospital (TUH) Abnormal EEG Corpus.
 
     Parameters
@@ -324,86 +337,89 @@ class TUHAbnormal(ConcatDataset):
     drop_samples: bool
         whether or not have a last overlapping supercrop/window, when
         supercrops/windows do not equally devide the continuous signal
-    target: str
-
+    target: str | list(str)
+        column(s) of info to be used as target(s), several targets require
+        use_mne_epochs=False
     mapping: dict{target_value: int}
         maps target values to integers
+    use_mne_epochs: bool
+        if False, windows are slices of the preloaded continuous signals
+        instead of mne.Epochs
+    dtype: str | None
+        storage dtype of the continuous signals if use_mne_epochs is False,
+        float32, float16 or int16 with a scale and offset per channel (not
+        used if lazy)
+    n_jobs: int
+        number of worker processes used to read and window the recordings
+        (not used if lazy) and of threads scanning path, -1 uses all cpus
+    lazy: bool
+        if True, only read the EDF headers on initialization and compute the
+        windows from the number of samples in the header. Recordings are
+        opened on first access of one of their windows, windows are always
+        ArrayWindows.
+    max_open_files: int
+        if lazy, maximum number of recordings kept open at the same time
+    manifest_path: str | None
+        path to a json manifest of the files in path, which is reused and
+        updated to only scan changed directories, see read_all_file_names
+    header_index_path: str | None
+        path to a json table of EDF headers, which is reused and updated,
+        see braindecode.datasets.edf.read_edf_headers
+    query: str | None
+        pandas query selecting recordings based on their headers, e.g.
+        "age > 50 and gender == 'F' and duration > 600 and sfreq == 250",
+        without reading any signal data
     """
 
     def __init__(self, path, trial_start_offset_samples,
                  trial_stop_offset_samples, supercrop_size_samples,
                  supercrop_stride_samples, subject_ids=None,
-                 drop_samples=False, target="pathological", mapping=None):
+                 drop_samples=False, target="pathological", mapping=None,
+                 use_mne_epochs=True, dtype=None, n_jobs=1, lazy=False,
+                 max_open_files=100, manifest_path=None,
+                 header_index_path=None, query=None):
         windower = FixedLengthWindower(
             trial_start_offset_samples=trial_start_offset_samples,
             trial_stop_offset_samples=trial_stop_offset_samples,
             supercrop_size_samples=supercrop_size_samples,
             supercrop_stride_samples=supercrop_stride_samples,
-            drop_samples=drop_samples, mapping=mapping)
+            drop_samples=drop_samples, mapping=mapping,
+            use_mne_epochs=use_mne_epochs,
+            dtype=dtype)
 
         all_file_paths = read_all_file_names(
-            path, extension='.edf', key=self._time_key)
+            path, extension='.edf', key=self._time_key,
+            manifest_path=manifest_path, n_jobs=n_jobs)
         if subject_ids is None:
             subject_ids = np.arange(len(all_file_paths))
 
-        all_windows_ds, all_infos = [], []
-        for subject_id in subject_ids:
-            file_path = all_file_paths[subject_id]
-            raw = mne.io.read_raw_edf(file_path)
-            path_splits = file_path.split("/")
-            if "abnormal" in path_splits:
-                pathological = True
-            else:
-                assert "normal" in path_splits
-                pathological = False
-            if "train" in path_splits:
-                session = "train"
-            else:
-                assert "eval" in path_splits
-                session = "eval"
-            age, gender = _parse_age_and_gender_from_edf_header(file_path)
-            info = pd.DataFrame(
-                [[age, pathological, gender, session, subject_id]],
-                columns=["age", "pathological", "gender",
-                "session", "subject"], index=[subject_id])
-            base_ds = BaseDataset(raw, info, target=target)
-            windows = windower(base_ds)
-            windows_ds = WindowsDataset(windows, base_ds.info)
-            all_windows_ds.append(windows_ds)
-            all_infos.append(info)
-
-        super().__init__(all_windows_ds)
-        self.info = pd.concat(all_infos)
-
-    def split(self, some_property=None, split_ids=None):
-        """Split the dataset based on some property listed in its info DataFrame
-        or based on indices.
-
-        Parameters
-        ----------
-        some_property: str
-            some property which is listed in info DataFrame
-        split_ids: list(int)
-            list of indices to be combined in a subset
-
-        Returns
-        -------
-        splits: dict{split_name: subset}
-            mapping of split name based on property or index based on split_ids
-            to subset of the data
-        """
-        assert split_ids is None or some_property is None, (
-            "can split either based on ids or based on some property")
-        if split_ids is None:
-            split_ids = _split_ids(self.info, some_property)
+        file_paths = [all_file_paths[subject_id] for subject_id in subject_ids]
+        headers = read_edf_headers(
+            file_paths, index_path=header_index_path, n_jobs=n_jobs)
+        headers["age"], headers["gender"] = zip(*[
+            _parse_age_and_gender(patient_id)
+            for patient_id in headers["patient_id"]])
+        if query is not None:
+            selected = headers.query(query).index
+            headers = headers.loc[selected].reset_index(drop=True)
+            subject_ids = np.asarray(subject_ids)[selected]
+        headers = headers.to_dict(orient="records")
+        if lazy:
+            # open readers are shared between all recordings
+            cache = EDFReaderCache(max_open_files=max_open_files)
+            all_windows_ds = _map_recordings(
+                _create_lazy_tuh_windows_ds,
+                [(header, subject_id, target, windower, cache)
+                 for header, subject_id in zip(headers, subject_ids)],
+                names=[header["path"] for header in headers], n_jobs=1)
         else:
-            split_ids = {split_i: split
-                         for split_i, split in enumerate(split_ids)}
-        # split_ids are indices for WindowsDatasets
-        supercrop_ids = _windows_dataset_ids_to_supercrop_ids(
-            split_ids, self.cumulative_sizes)
-        return {split_name: Subset(self, split)
-                for split_name, split in supercrop_ids.items()}
+            all_windows_ds = _map_recordings(
+                _create_tuh_windows_ds,
+                [(header, subject_id, target, windower)
+                 for header, subject_id in zip(headers, subject_ids)],
+                names=[header["path"] for header in headers], n_jobs=n_jobs)
+        all_infos = [windows_ds.info for windows_ds in all_windows_ds]
+        super().__init__(all_windows_ds, pd.concat(all_infos))
 
     def _time_key(self, file_path):
         # the splits are specific to tuh abnormal eeg data set
@@ -416,8 +432,44 @@ class TUHAbnormal(ConcatDataset):
         return date_id + session_id + recording_id
 
 
-# TODO: this is very slow. how to improve?
-def read_all_file_names(directory, extension, key):
+def _create_tuh_windows_ds(header, subject_id, target, windower):
+    raw = mne.io.read_raw_edf(header["path"])
+    info = _create_tuh_info(
+        header["path"], subject_id, header["age"], header["gender"])
+    return _create_windows_ds(raw, info, windower, target=target)
+
+
+def _create_lazy_tuh_windows_ds(header, subject_id, target, windower, cache):
+    info = _create_tuh_info(
+        header["path"], subject_id, header["age"], header["gender"])
+    events, metadata, targets = windower.create_index(
+        header["n_times"], info, target)
+    windows = _array_windows_from_events(
+        LazyEDFRecording(header["path"], header, cache), header["n_times"],
+        events, metadata, windower.size, targets=targets)
+    return WindowsDataset(windows, info)
+
+
+def _create_tuh_info(file_path, subject_id, age, gender):
+    path_splits = file_path.split("/")
+    if "abnormal" in path_splits:
+        pathological = True
+    else:
+        assert "normal" in path_splits
+        pathological = False
+    if "train" in path_splits:
+        session = "train"
+    else:
+        assert "eval" in path_splits
+        session = "eval"
+    return pd.DataFrame(
+        [[age, pathological, gender, session, subject_id]],
+        columns=["age", "pathological", "gender",
+        "session", "subject"], index=[subject_id])
+
+
+def read_all_file_names(directory, extension, key, manifest_path=None,
+                        n_jobs=1):
     """Read all files with specified extension from given path and sorts them
     based on a given sorting key.
 
@@ -429,6 +481,13 @@ def read_all_file_names(directory, extension, key):
         file path extension, i.e. '.edf' or '.txt'
     key: calable
         sorting key for the file paths
+    manifest_path: str | None
+        path to a json manifest of the directory tree. If given, only
+        directories whose modification time changed since the manifest was
+        written are scanned again and sorting keys are reused. The manifest
+        is (re)written afterwards.
+    n_jobs: int
+        number of threads scanning directories in parallel, -1 uses all cpus
 
     Returns
     -------
@@ -436,11 +495,69 @@ def read_all_file_names(directory, extension, key):
         a list to all files found in (sub)directories of path
     """
     assert extension.startswith(".")
-    file_paths = glob.glob(directory + '**/*' + extension, recursive=True)
-    file_paths = sorted(file_paths, key=key)
-    assert len(file_paths) > 0, (
-        f"something went wrong. Found no {extension} files in {path}")
-    return file_paths
+    manifest = {}
+    if manifest_path is not None and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["extension"] != extension:
+            manifest = {}
+    cached_directories = manifest.get("directories", {})
+
+    directories = _scan_directory_tree(
+        directory, extension, cached_directories, n_jobs)
+    files = [file for scanned in directories.values()
+             for file in scanned["files"]]
+    for file in files:
+        if "key" not in file:
+            file["key"] = key(file["path"])
+    files = sorted(files, key=lambda file: file["key"])
+    assert len(files) > 0, (
+        f"something went wrong. Found no {extension} files in {directory}")
+
+    if manifest_path is not None:
+        with open(manifest_path, "w") as f:
+            json.dump({"extension": extension, "directories": directories}, f)
+    return [file["path"] for file in files]
+
+
+def _scan_directory_tree(directory, extension, cached_directories, n_jobs):
+    """Walk the directory tree level by level, scanning the directories of
+    one level in parallel threads."""
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    directories = {}
+    level = [directory]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        while len(level) > 0:
+            scanned = executor.map(
+                lambda path: _scan_directory(
+                    path, extension, cached_directories.get(path)),
+                level)
+            level = []
+            for path, this_scanned in scanned:
+                directories[path] = this_scanned
+                level.extend(this_scanned["subdirs"])
+    return directories
+
+
+def _scan_directory(path, extension, cached):
+    mtime = os.stat(path).st_mtime
+    if cached is not None and cached["mtime"] == mtime:
+        # no entries were added, removed or renamed since the last scan
+        return path, cached
+    subdirs, files = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            # like glob, ignore hidden files and directories
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            elif entry.name.endswith(extension):
+                stat = entry.stat()
+                files.append({"path": entry.path, "size": stat.st_size,
+                              "mtime": stat.st_mtime})
+    return path, {"mtime": mtime, "subdirs": sorted(subdirs), "files": files}
 
 
 def _natural_key(string):
@@ -458,6 +575,4 @@ def _parse_age_and_gender_from_edf_header(file_path, return_raw_header=False):
     if return_raw_header:
         return content
     patient_id = content[8:88].decode('ascii')
-    [age] = re.findall("Age:(\d+)", patient_id)
-    [gender] = re.findall("\s(\w)\s", patient_id)
-    return int(age), gender
+    return _parse_age_and_gender(patient_id)
@@ -0,0 +1,192 @@
+"""
+Lazy access to EDF recordings.
+"""
+
+# Authors: Lukas Gemein <l.gemein@gmail.com>
+#
+# License: BSD (3-clause)
+
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import mne
+
+
+def read_edf_header(file_path):
+    """Read the header of an EDF file without reading any signal data.
+
+    Parameters
+    ----------
+    file_path: str
+        path to an EDF file
+
+    Returns
+    -------
+    header: dict
+        patient_id, recording_id, ch_names, sfreq and n_times of the
+        recording, where sfreq and n_times refer to the signal as read by
+        mne.io.read_raw_edf
+    """
+    with open(file_path, 'rb') as f:
+        content = f.read(256)
+        n_signals = int(content[252:256])
+        content += f.read(256 * n_signals)
+    n_records = int(content[236:244])
+    record_duration = float(content[244:252])
+
+    def signal_fields(offset, width):
+        fields = content[256 + offset * n_signals:
+                         256 + (offset + width) * n_signals]
+        return [fields[i * width:(i + 1) * width].decode('ascii').strip()
+                for i in range(n_signals)]
+
+    # offsets of fields in the signal header in bytes per signal
+    ch_names = signal_fields(0, 16)
+    n_samples_per_record = [int(n) for n in signal_fields(216, 8)]
+    # annotations are not part of the signal read by mne
+    n_samples_per_record = [
+        n for n, ch_name in zip(n_samples_per_record, ch_names)
+        if ch_name != 'EDF Annotations']
+    ch_names = [ch_name for ch_name in ch_names
+                if ch_name != 'EDF Annotations']
+    # mne upsamples all channels to the highest sampling frequency
+    max_n_samples = max(n_samples_per_record)
+    return dict(
+        patient_id=content[8:88].decode('ascii'),
+        recording_id=content[88:168].decode('ascii'),
+        ch_names=ch_names,
+        sfreq=max_n_samples / record_duration,
+        n_times=n_records * max_n_samples,
+    )
+
+
+def read_edf_headers(file_paths, index_path=None, n_jobs=1):
+    """Read the headers of many EDF files in parallel threads, opening every
+    file once, into a table. The table can be stored on disk and is then
+    reused for files whose size and modification time did not change.
+
+    Parameters
+    ----------
+    file_paths: list(str)
+        paths to EDF files
+    index_path: str | None
+        path to a json file holding the table of previously read headers,
+        which is updated with the headers read
+    n_jobs: int
+        number of threads reading headers, -1 uses all cpus
+
+    Returns
+    -------
+    headers: pandas.DataFrame
+        one row per file in order of file_paths with path, size, mtime and
+        the fields returned by read_edf_header as well as the duration in
+        seconds
+    """
+    index = {}
+    if index_path is not None and os.path.exists(index_path):
+        with open(index_path) as f:
+            index = {row["path"]: row for row in json.load(f)}
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        rows = list(executor.map(
+            lambda file_path: _read_header_row(file_path, index.get(file_path)),
+            file_paths))
+    if index_path is not None:
+        index.update({row["path"]: row for row in rows})
+        with open(index_path, "w") as f:
+            json.dump(list(index.values()), f)
+    columns = ["path", "size", "mtime", "patient_id", "recording_id",
+               "ch_names", "sfreq", "n_times", "duration"]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def _read_header_row(file_path, cached_row):
+    stat = os.stat(file_path)
+    if (cached_row is not None and cached_row["size"] == stat.st_size and
+            cached_row["mtime"] == stat.st_mtime):
+        return cached_row
+    row = dict(path=file_path, size=stat.st_size, mtime=stat.st_mtime)
+    row.update(read_edf_header(file_path))
+    row["duration"] = row["n_times"] / row["sfreq"]
+    return row
+
+
+def _parse_age_and_gender(patient_id):
+    [age] = re.findall(r"Age:(\d+)", patient_id)
+    [gender] = re.findall(r"\s(\w)\s", patient_id)
+    return int(age), gender
+
+
+class EDFReaderCache(object):
+    """Least recently used cache of EDF readers, i.e. mne.io.Raw objects that
+    are not preloaded, such that only a bounded number of recordings is open
+    at any time. Can be shared between threads, e.g. of a PrefetchIterator.
+
+    Parameters
+    ----------
+    max_open_files: int
+        maximum number of readers kept open
+    """
+    def __init__(self, max_open_files=100):
+        assert max_open_files > 0, "cache has to hold at least one reader"
+        self.max_open_files = max_open_files
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path):
+        """Get the reader of an EDF file, opening it if necessary."""
+        with self._lock:
+            if file_path in self._readers:
+                self._readers.move_to_end(file_path)
+                return self._readers[file_path]
+            raw = mne.io.read_raw_edf(
+                file_path, preload=False, verbose='error')
+            self._readers[file_path] = raw
+            if len(self._readers) > self.max_open_files:
+                _, least_recently_used = self._readers.popitem(last=False)
+                least_recently_used.close()
+            return raw
+
+    def __len__(self):
+        return len(self._readers)
+
+    def __getstate__(self):
+        # readers are not pickled, e.g. to DataLoader workers, which open
+        # their own readers, and neither is the lock
+        state = self.__dict__.copy()
+        state['_readers'] = OrderedDict()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class LazyEDFRecording(object):
+    """A continuous EDF recording that is only opened on first access. Can be
+    sliced like an array of shape (n_channels, n_times).
+
+    Parameters
+    ----------
+    file_path: str
+        path to an EDF file
+    header: dict
+        header as returned by read_edf_header
+    cache: EDFReaderCache
+        cache of open EDF readers, shared between recordings
+    """
+    def __init__(self, file_path, header, cache):
+        self.file_path = file_path
+        self.shape = (len(header['ch_names']), header['n_times'])
+        self.cache = cache
+
+    def __getitem__(self, item):
+        raw = self.cache.get(self.file_path)
+        return raw[item][0]
@@ -3,5 +3,7 @@ Utilities for data manipulation.
 """
 
 from .signal_target import SignalAndTarget
-from .windowers import EventWindower, FixedLengthWindower
+from .windowers import (
+    EventWindower, FixedLengthWindower, StreamingWindower, ArrayWindows,
+    QuantizedSignal)
 from .transforms import FilterRaw, ZscoreRaw, FilterWindow, ZscoreWindow
@@ -1,6 +1,12 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+
 import numpy as np
+import torch
 from numpy.random import RandomState
 
+from braindecode.datasets.base import _getitems
 from braindecode.util import get_balanced_batches
 
 
@@ -28,6 +34,10 @@ class CropsFromTrialsIterator(object):
     seed: int
         Random seed for initialization of `numpy.RandomState` random generator
         that shuffles the batches.
+
+    Batches are filled into preallocated buffers of a BatchBufferPool. Pass a
+    batch to :meth:`release` once it is not used anymore, to reuse its
+    buffer for one of the next batches.
     
     See Also
     --------
@@ -46,64 +56,210 @@ class CropsFromTrialsIterator(object):
         self.n_preds_per_input = n_preds_per_input
         self.seed = seed
         self.rng = RandomState(self.seed)
+        self.buffer_pool = BatchBufferPool()
 
     def reset_rng(self):
         self.rng = RandomState(self.seed)
 
+    def release(self, batch):
+        """Return the input array of a batch to the buffer pool. It is
+        overwritten by one of the next batches.
+
+        Parameters
+        ----------
+        batch: (ndarray, ndarray)
+            batch as yielded by get_batches
+        """
+        self.buffer_pool.release(batch[0])
+
     def get_batches(self, dataset, shuffle):
+        batch_blocks = self.get_batch_blocks(dataset, shuffle)
+        return (self.create_batch(dataset, blocks) for blocks in batch_blocks)
+
+    def get_batch_blocks(self, dataset, shuffle):
+        """Get the crops of every batch, drawing their order from self.rng.
+
+        Parameters
+        ----------
+        dataset: object with X and y
+        shuffle: bool
+
+        Returns
+        -------
+        batch_blocks: list of 2darray of int
+            Per batch, trial index, start and stop of every crop.
+        """
         # start always at first predictable sample, so
         # start at end of receptive field
         n_receptive_field = self.input_time_length - self.n_preds_per_input + 1
-        i_trial_starts = [n_receptive_field - 1] * len(dataset.X)
-        i_trial_stops = [trial.shape[1] for trial in dataset.X]
+        i_trial_stops = np.array([trial.shape[1] for trial in dataset.X])
 
         # Check whether input lengths ok
-        input_lens = i_trial_stops
-        for i_trial, input_len in enumerate(input_lens):
-            assert input_len >= self.input_time_length, (
-                "Input length {:d} of trial {:d} is smaller than the "
-                "input time length {:d}".format(
-                    input_len, i_trial, self.input_time_length
-                )
+        too_short = np.flatnonzero(i_trial_stops < self.input_time_length)
+        assert len(too_short) == 0, (
+            "Input length {:d} of trial {:d} is smaller than the "
+            "input time length {:d}".format(
+                i_trial_stops[too_short[0]], too_short[0],
+                self.input_time_length
             )
-        start_stop_blocks_per_trial = _compute_start_stop_block_inds(
-            i_trial_starts,
-            i_trial_stops,
+        )
+        i_trial_start_stop_block = _cached_i_trial_start_stop_blocks(
+            (n_receptive_field - 1,) * len(i_trial_stops),
+            tuple(i_trial_stops.tolist()),
             self.input_time_length,
             self.n_preds_per_input,
-            check_preds_smaller_trial_len=True,
-        )
-        for i_trial, trial_blocks in enumerate(start_stop_blocks_per_trial):
-            assert trial_blocks[0][0] == 0
-            assert trial_blocks[-1][1] == i_trial_stops[i_trial]
-
-        return self._yield_block_batches(
-            dataset.X, dataset.y, start_stop_blocks_per_trial, shuffle=shuffle
+            True,
         )
-
-    def _yield_block_batches(self, X, y, start_stop_blocks_per_trial, shuffle):
-        # add trial nr to start stop blocks and flatten at same time
-        i_trial_start_stop_block = [
-            (i_trial, start, stop)
-            for i_trial, block in enumerate(start_stop_blocks_per_trial)
-            for (start, stop) in block
-        ]
-        i_trial_start_stop_block = np.array(i_trial_start_stop_block)
-        if i_trial_start_stop_block.ndim == 1:
-            i_trial_start_stop_block = i_trial_start_stop_block[None, :]
-
         blocks_per_batch = get_balanced_batches(
             len(i_trial_start_stop_block),
             batch_size=self.batch_size,
             rng=self.rng,
             shuffle=shuffle,
         )
-        for i_blocks in blocks_per_batch:
-            start_stop_blocks = i_trial_start_stop_block[i_blocks]
-            batch = _create_batch_from_i_trial_start_stop_blocks(
-                X, y, start_stop_blocks, self.n_preds_per_input
-            )
-            yield batch
+        return [i_trial_start_stop_block[i_blocks]
+                for i_blocks in blocks_per_batch]
+
+    def create_batch(self, dataset, blocks):
+        """Create the batch of given crops of the dataset.
+
+        Parameters
+        ----------
+        dataset: object with X and y
+        blocks: 2darray of int
+            Trial index, start and stop of every crop.
+
+        Returns
+        -------
+        batch_X: ndarray
+        batch_y: ndarray
+        """
+        return _create_batch_from_i_trial_start_stop_blocks(
+            dataset.X, dataset.y, blocks, self.n_preds_per_input,
+            buffer_pool=self.buffer_pool,
+        )
+
+
+class WindowsIterator(object):
+    """
+    Iterator over batches of windows datasets, which gathers every batch at
+    once via the dataset's __getitems__.
+
+    Parameters
+    ----------
+    batch_size: int
+    seed: int
+        Random seed for initialization of `numpy.RandomState` random generator
+        that shuffles the batches.
+    """
+    def __init__(self, batch_size, seed=(2017, 6, 28)):
+        self.batch_size = batch_size
+        self.seed = seed
+        self.rng = RandomState(self.seed)
+
+    def reset_rng(self):
+        self.rng = RandomState(self.seed)
+
+    def get_batches(self, dataset, shuffle):
+        batch_inds = self.get_batch_blocks(dataset, shuffle)
+        return (self.create_batch(dataset, inds) for inds in batch_inds)
+
+    def get_batch_blocks(self, dataset, shuffle):
+        """Get the window indices of every batch, drawing their order from
+        self.rng."""
+        return [np.asarray(inds) for inds in get_balanced_batches(
+            len(dataset), rng=self.rng, shuffle=shuffle,
+            batch_size=self.batch_size)]
+
+    def create_batch(self, dataset, inds):
+        """Gather windows, targets and supercrop indices of a batch."""
+        batch = _getitems(dataset, inds)
+        return batch.X, batch.y, batch.ind
+
+
+class PrefetchIterator(object):
+    """
+    Wraps a CropsFromTrialsIterator or WindowsIterator to assemble the next
+    batches in background threads or processes, while the current batch is
+    used. The order of batches is drawn in the main process, so batches are
+    the same and in the same order as without prefetching.
+
+    Parameters
+    ----------
+    iterator: CropsFromTrialsIterator | WindowsIterator
+    n_prefetch: int
+        Number of batches assembled ahead of the batch that is used.
+    n_jobs: int
+        Number of threads or processes assembling batches.
+    use_processes: bool
+        If True, assemble batches in worker processes, that receive the
+        dataset once per call of get_batches and return batches through
+        shared memory. Otherwise, use threads, which share the dataset.
+    """
+    def __init__(self, iterator, n_prefetch=2, n_jobs=1,
+                 use_processes=False):
+        assert n_prefetch > 0, "n_prefetch has to be larger than 0"
+        self.iterator = iterator
+        self.n_prefetch = n_prefetch
+        self.n_jobs = n_jobs
+        self.use_processes = use_processes
+
+    def reset_rng(self):
+        self.iterator.reset_rng()
+
+    def release(self, batch):
+        """Return a batch to the buffer pool of the wrapped iterator, see
+        CropsFromTrialsIterator.release."""
+        if not self.use_processes and hasattr(self.iterator, "release"):
+            self.iterator.release(batch)
+
+    def get_batches(self, dataset, shuffle):
+        batch_blocks = self.iterator.get_batch_blocks(dataset, shuffle)
+        return self._prefetch(dataset, batch_blocks)
+
+    def _prefetch(self, dataset, batch_blocks):
+        if self.use_processes:
+            executor = ProcessPoolExecutor(
+                max_workers=self.n_jobs, initializer=_init_prefetch_worker,
+                initargs=(self.iterator, dataset))
+            create_batch = _create_batch_in_worker
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.n_jobs)
+            create_batch = partial(self.iterator.create_batch, dataset)
+        pending = deque()
+        try:
+            for blocks in batch_blocks:
+                pending.append(executor.submit(create_batch, blocks))
+                if len(pending) > self.n_prefetch:
+                    yield self._result(pending.popleft())
+            while len(pending) > 0:
+                yield self._result(pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def _result(self, future):
+        batch = future.result()
+        if self.use_processes:
+            # tensors were moved to shared memory by the worker
+            batch = tuple(tensor.numpy() for tensor in batch)
+        return batch
+
+
+_prefetch_worker_state = {}
+
+
+def _init_prefetch_worker(iterator, dataset):
+    _prefetch_worker_state["iterator"] = iterator
+    _prefetch_worker_state["dataset"] = dataset
+
+
+def _create_batch_in_worker(blocks):
+    batch = _prefetch_worker_state["iterator"].create_batch(
+        _prefetch_worker_state["dataset"], blocks)
+    # pickling tensors to the main process moves them to shared memory
+    # instead of copying them through the pipe
+    return tuple(torch.from_numpy(np.asarray(array)) for array in batch)
 
 
 def _compute_start_stop_block_inds(
@@ -131,31 +287,88 @@ def _compute_start_stop_block_inds(
         Per trial, a list of 2-tuples indicating start and stop index
         of the inputs needed to predict entire trial.
     """
-    # create start stop indices for all batches still 2d trial -> start stop
-    start_stop_blocks_per_trial = []
-    for i_trial in range(len(i_trial_starts)):
-        i_trial_start = i_trial_starts[i_trial]
-        i_trial_stop = i_trial_stops[i_trial]
-        start_stop_blocks = _get_start_stop_blocks_for_trial(
-            i_trial_start, i_trial_stop, input_time_length, n_preds_per_input
-        )
+    i_trial_start_stop_block = _cached_i_trial_start_stop_blocks(
+        tuple(np.asarray(i_trial_starts).tolist()),
+        tuple(np.asarray(i_trial_stops).tolist()),
+        input_time_length,
+        n_preds_per_input,
+        check_preds_smaller_trial_len,
+    )
+    blocks = i_trial_start_stop_block[:, 1:].tolist()
+    i_block_stops = np.cumsum(np.bincount(
+        i_trial_start_stop_block[:, 0], minlength=len(i_trial_starts)))
+    i_block_starts = np.insert(i_block_stops[:-1], 0, 0)
+    return [
+        [tuple(block) for block in blocks[i_start:i_stop]]
+        for i_start, i_stop in zip(i_block_starts, i_block_stops)
+    ]
 
-        if check_preds_smaller_trial_len:
-            # check that block is correct, all predicted samples together
-            # should be the trial samples
-            all_predicted_samples = [
-                range(stop - n_preds_per_input, stop)
-                for _, stop in start_stop_blocks
-            ]
-            # this check takes about 50 ms in performance test
-            # whereas loop itself takes only 5 ms.. deactivate it if not necessary
-            assert np.array_equal(
-                range(i_trial_starts[i_trial], i_trial_stops[i_trial]),
-                np.unique(np.concatenate(all_predicted_samples)),
-            )
 
-        start_stop_blocks_per_trial.append(start_stop_blocks)
-    return start_stop_blocks_per_trial
+@lru_cache(maxsize=32)
+def _cached_i_trial_start_stop_blocks(
+    i_trial_starts,
+    i_trial_stops,
+    input_time_length,
+    n_preds_per_input,
+    check_preds_smaller_trial_len,
+):
+    # trial starts and stops are tuples, such that they can be hashed.
+    # the cached array is read-only, as it is shared between calls
+    i_trial_start_stop_block = _compute_i_trial_start_stop_blocks(
+        np.array(i_trial_starts, dtype=np.int64),
+        np.array(i_trial_stops, dtype=np.int64),
+        input_time_length,
+        n_preds_per_input,
+        check_preds_smaller_trial_len,
+    )
+    i_trial_start_stop_block.flags.writeable = False
+    return i_trial_start_stop_block
+
+
+def _compute_i_trial_start_stop_blocks(
+    i_trial_starts,
+    i_trial_stops,
+    input_time_length,
+    n_preds_per_input,
+    check_preds_smaller_trial_len,
+):
+    """
+    Compute start stop block inds for all trials at once.
+    Parameters
+    ----------
+    i_trial_starts: 1darray of int
+        Indices of first samples to predict(!).
+    i_trial_stops: 1darray of int
+        Indices one past last sample to predict.
+    input_time_length: int
+    n_preds_per_input: int
+    check_preds_smaller_trial_len: bool
+        Check whether predictions fit inside trial
+    Returns
+    -------
+    i_trial_start_stop_block: 2darray of int
+        Trial index, start and stop index of the inputs needed to predict
+        all trials, one row per block.
+    """
+    n_samples = np.maximum(i_trial_stops - i_trial_starts, 0)
+    if check_preds_smaller_trial_len:
+        # block stops are n_preds_per_input apart and the last block stops
+        # at the trial stop, so all samples of a trial are predicted without
+        # gaps. Only if a trial is shorter than n_preds_per_input, samples
+        # before the trial start are predicted
+        assert (n_samples >= n_preds_per_input).all(), (
+            "Trials have to be at least as long as n_preds_per_input")
+    # every block adds n_preds_per_input predicted samples, the last block
+    # is shifted back to stop at the trial stop
+    n_blocks = -(-n_samples // n_preds_per_input)
+    i_trials = np.repeat(np.arange(len(n_blocks)), n_blocks)
+    i_block_in_trials = np.arange(len(i_trials)) - np.repeat(
+        np.cumsum(n_blocks) - n_blocks, n_blocks)
+    stops = np.minimum(
+        i_trial_starts[i_trials] + (i_block_in_trials + 1) * n_preds_per_input,
+        i_trial_stops[i_trials],
+    )
+    return np.stack([i_trials, stops - input_time_length, stops], axis=1)
 
 
 def _get_start_stop_blocks_for_trial(
@@ -178,33 +391,63 @@ def _get_start_stop_blocks_for_trial(
         A list of 2-tuples indicating start and stop index
         of the inputs needed to predict entire trial.
     """
-    start_stop_blocks = []
-    i_window_stop = i_trial_start  # now when we add sample preds in loop,
-    # first sample of trial corresponds to first prediction
-    while i_window_stop < i_trial_stop:
-        i_window_stop += n_preds_per_input
-        i_adjusted_stop = min(i_window_stop, i_trial_stop)
-        i_window_start = i_adjusted_stop - input_time_length
-        start_stop_blocks.append((i_window_start, i_adjusted_stop))
+    i_trial_start_stop_block = _compute_i_trial_start_stop_blocks(
+        np.array([i_trial_start]),
+        np.array([i_trial_stop]),
+        input_time_length,
+        n_preds_per_input,
+        check_preds_smaller_trial_len=False,
+    )
+    return [tuple(block) for block in i_trial_start_stop_block[:, 1:].tolist()]
+
+
+class BatchBufferPool(object):
+    """
+    Pool of preallocated arrays, such that batches of the same shape and
+    dtype are filled into the same memory instead of allocating every
+    batch anew. Can be shared between threads, as only atomic operations on
+    the lists of free arrays are used.
+    """
+    def __init__(self):
+        self._free = {}
+
+    def get(self, shape, dtype):
+        """Get an array of given shape and dtype with arbitrary content."""
+        free = self._free.setdefault((tuple(shape), np.dtype(dtype)), [])
+        try:
+            return free.pop()
+        except IndexError:
+            return np.empty(shape, dtype=dtype)
 
-    return start_stop_blocks
+    def release(self, buffer):
+        """Return an array to the pool, it must not be used afterwards."""
+        assert buffer.base is None, "only arrays owning memory can be pooled"
+        self._free.setdefault((buffer.shape, buffer.dtype), []).append(buffer)
 
 
 def _create_batch_from_i_trial_start_stop_blocks(
-    X, y, i_trial_start_stop_block, n_preds_per_input=None
+    X, y, i_trial_start_stop_block, n_preds_per_input=None, buffer_pool=None
 ):
-    Xs = []
-    ys = []
-    for i_trial, start, stop in i_trial_start_stop_block:
-        Xs.append(X[i_trial][:, start:stop])
-        if not hasattr(y[i_trial], "__len__"):
-            ys.append(y[i_trial])
-        else:
-            assert n_preds_per_input is not None
-            ys.append(y[i_trial][stop - n_preds_per_input : stop])
-    batch_X = np.array(Xs)
-    batch_y = np.array(ys)
+    i_trial_start_stop_block = np.asarray(i_trial_start_stop_block)
+    i_trials, starts, stops = i_trial_start_stop_block.T
+    n_times = stops[0] - starts[0]
+    n_channels = X[0].shape[0]
+    dtype = X.dtype if isinstance(X, np.ndarray) else X[0].dtype
     # add empty fourth dimension if necessary
-    if batch_X.ndim == 3:
-        batch_X = batch_X[:, :, :, None]
+    shape = ((len(i_trial_start_stop_block), n_channels, n_times) +
+             (X[0].shape[2:] or (1,)))
+    if buffer_pool is None:
+        buffer_pool = BatchBufferPool()
+    batch_X = buffer_pool.get(shape, dtype)
+    # copying every block into the buffer is as fast as a single gather,
+    # and blocks out of the trials fail on the shape mismatch
+    for x, (i_trial, start, stop) in zip(batch_X, i_trial_start_stop_block):
+        x[...] = X[i_trial][:, start:stop].reshape(x.shape)
+    if not hasattr(y[0], "__len__"):
+        batch_y = np.asarray(y)[i_trials]
+    else:
+        assert n_preds_per_input is not None
+        batch_y = np.array(
+            [y[i_trial][stop - n_preds_per_input: stop]
+             for i_trial, stop in zip(i_trials, stops)])
     return batch_X, batch_y
@@ -0,0 +1,102 @@
+"""
+Samplers over windows of concatenated recordings.
+"""
+
+# License: BSD (3-clause)
+
+import numpy as np
+from torch.utils.data import Sampler
+
+from ..datasets.base import _supercrop_ids_of_windows
+
+
+class RecordingSampler(Sampler):
+    """
+    Samples windows of a concatenation of recordings, e.g. MOABBDataset or
+    TUHAbnormal, such that only a bounded number of recordings is accessed
+    at any time. This keeps file and page caches effective when recordings
+    are loaded lazily or memory-mapped.
+
+    Recordings are shuffled and every window is assigned a random position
+    within n_open_recordings recordings after the position of its
+    recording. Windows are returned sorted by these positions, so windows of
+    at most n_open_recordings + 1 recordings are interleaved at any time.
+    With n_open_recordings=1, windows are shuffled only within recordings,
+    with n_open_recordings equal to the number of recordings, windows are
+    shuffled almost uniformly.
+
+    Recordings with windows are split between replicas, e.g. distributed
+    ranks, which receive the same number of windows by repeating windows. With
+    DataLoader workers, consecutive batches go to different workers, which
+    therefore access the same few recordings.
+
+    Parameters
+    ----------
+    dataset: torch.utils.data.ConcatDataset
+        concatenation of one dataset per recording, or a split of a
+        BaseConcatDataset
+    n_open_recordings: int
+        number of recordings whose windows are shuffled together
+    shuffle: bool
+        if False, return windows of the recordings of this replica in order
+    seed: int
+        seed of the random generator, combined with the epoch
+    num_replicas: int
+        number of replicas sharing the recordings
+    rank: int
+        index of this replica
+    """
+    def __init__(self, dataset, n_open_recordings=4, shuffle=True, seed=0,
+                 num_replicas=1, rank=0):
+        assert n_open_recordings > 0, (
+            "n_open_recordings has to be larger than 0")
+        assert 0 <= rank < num_replicas, "rank has to be in [0, num_replicas)"
+        self.cumulative_sizes = np.asarray(dataset.cumulative_sizes)
+        # recordings without windows are not distributed, such that no
+        # replica is left without windows
+        self.recordings = np.flatnonzero(
+            np.diff(self.cumulative_sizes, prepend=0) > 0)
+        self.n_open_recordings = n_open_recordings
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        assert len(self.recordings) >= num_replicas, (
+            "every replica needs at least one recording with windows")
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        """Set the epoch, such that every epoch is shuffled differently."""
+        self.epoch = epoch
+        # recordings are distributed to replicas in turns, the replica with
+        # most windows determines the number of samples of every replica
+        sizes = np.diff(self.cumulative_sizes, prepend=0)
+        recordings = self._recording_order()
+        self.num_samples = max(
+            sizes[recordings[i_replica::self.num_replicas]].sum()
+            for i_replica in range(self.num_replicas))
+
+    def __iter__(self):
+        rng = np.random.RandomState([self.seed, self.epoch])
+        recordings = self._recording_order(rng)[self.rank::self.num_replicas]
+        window_ids = _supercrop_ids_of_windows(
+            self.cumulative_sizes, recordings)
+        if self.shuffle and len(window_ids) > 0:
+            sizes = np.diff(self.cumulative_sizes, prepend=0)[recordings]
+            positions = np.repeat(np.arange(len(recordings)), sizes)
+            positions = positions + rng.uniform(
+                0, self.n_open_recordings, size=len(positions))
+            window_ids = window_ids[np.argsort(positions, kind="stable")]
+        # repeat windows, such that all replicas have the same length
+        window_ids = np.resize(window_ids, self.num_samples)
+        return iter(window_ids.tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+    def _recording_order(self, rng=None):
+        if not self.shuffle:
+            return self.recordings
+        if rng is None:
+            rng = np.random.RandomState([self.seed, self.epoch])
+        return rng.permutation(self.recordings)
@@ -1,6 +1,8 @@
+import os
 import logging
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
 import numpy as np
 import scipy
 import scipy.signal
@@ -9,7 +11,8 @@ log = logging.getLogger(__name__)
 
 
 def exponential_running_standardize(
-    data, factor_new=0.001, init_block_size=None, eps=1e-4
+    data, factor_new=0.001, init_block_size=None, eps=1e-4, inplace=False,
+    chunk_size=512,
 ):
     """
     Perform exponential running standardization. 
@@ -32,35 +35,28 @@ def exponential_running_standardize(
         Standardize data before to this index with regular standardization. 
     eps: float
         Stabilizer for division by zero variance.
+    inplace: bool
+        Whether to write the standardized data into data, which has to be a
+        float array.
+    chunk_size: int
+        Number of time points processed at once in float64 precision.
 
     Returns
     -------
     standardized: 2darray (time, channels)
-        Standardized data.
-    """
-    df = pd.DataFrame(data)
-    meaned = df.ewm(alpha=factor_new).mean()
-    demeaned = df - meaned
-    squared = demeaned * demeaned
-    square_ewmed = squared.ewm(alpha=factor_new).mean()
-    standardized = demeaned / np.maximum(eps, np.sqrt(np.array(square_ewmed)))
-    standardized = np.array(standardized)
-    if init_block_size is not None:
-        other_axis = tuple(range(1, len(data.shape)))
-        init_mean = np.mean(
-            data[0:init_block_size], axis=other_axis, keepdims=True
-        )
-        init_std = np.std(
-            data[0:init_block_size], axis=other_axis, keepdims=True
-        )
-        init_block_standardized = (
-            data[0:init_block_size] - init_mean
-        ) / np.maximum(eps, init_std)
-        standardized[0:init_block_size] = init_block_standardized
+        Standardized data, float32 for float32 data, else float64.
+    """
+    standardizer = ExponentialRunningStandardizer(
+        factor_new=factor_new, init_block_size=init_block_size, eps=eps)
+    standardized = _output_array(data, inplace)
+    for i_start in range(0, len(data), chunk_size):
+        standardizer(data[i_start:i_start + chunk_size],
+                     out=standardized[i_start:i_start + chunk_size])
     return standardized
 
 
-def exponential_running_demean(data, factor_new=0.001, init_block_size=None):
+def exponential_running_demean(data, factor_new=0.001, init_block_size=None,
+                               inplace=False, chunk_size=512):
     """
     Perform exponential running demeanining. 
 
@@ -77,25 +73,181 @@ def exponential_running_demean(data, factor_new=0.001, init_block_size=None):
     factor_new: float
     init_block_size: int
         Demean data before to this index with regular demeaning. 
+    inplace: bool
+        Whether to write the demeaned data into data, which has to be a
+        float array.
+    chunk_size: int
+        Number of time points processed at once in float64 precision.
         
     Returns
     -------
     demeaned: 2darray (time, channels)
-        Demeaned data.
-    """
-    df = pd.DataFrame(data)
-    meaned = df.ewm(alpha=factor_new).mean()
-    demeaned = df - meaned
-    demeaned = np.array(demeaned)
-    if init_block_size is not None:
-        other_axis = tuple(range(1, len(data.shape)))
-        init_mean = np.mean(
-            data[0:init_block_size], axis=other_axis, keepdims=True
-        )
-        demeaned[0:init_block_size] = data[0:init_block_size] - init_mean
+        Demeaned data, float32 for float32 data, else float64.
+    """
+    demeaner = ExponentialRunningDemeaner(
+        factor_new=factor_new, init_block_size=init_block_size)
+    demeaned = _output_array(data, inplace)
+    for i_start in range(0, len(data), chunk_size):
+        demeaner(data[i_start:i_start + chunk_size],
+                 out=demeaned[i_start:i_start + chunk_size])
     return demeaned
 
 
+class ExponentialRunningDemeaner(object):
+    """
+    Stateful exponential running demeaning, see exponential_running_demean.
+    Consecutive chunks of a recording, e.g. read from disk or received live,
+    are demeaned as if the whole recording was demeaned at once.
+
+    Parameters
+    ----------
+    factor_new: float
+    init_block_size: int
+        Demean data before to this index with regular demeaning.
+    """
+    def __init__(self, factor_new=0.001, init_block_size=None):
+        self.factor_new = factor_new
+        self.init_block_size = init_block_size
+        self.reset()
+
+    def reset(self):
+        """Forget all data seen so far, to start a new recording."""
+        self.n_samples = 0
+        self._running_mean = _ExponentialRunningMean(self.factor_new)
+
+    def __call__(self, chunk, out=None):
+        """
+        Parameters
+        ----------
+        chunk: 2darray (time, channels)
+            Next chunk of the recording.
+        out: 2darray (time, channels), optional
+            Array the demeaned chunk is written to, may be chunk itself.
+
+        Returns
+        -------
+        demeaned: 2darray (time, channels)
+        """
+        init_block = self._init_block(chunk)
+        if init_block is not None:
+            other_axis = tuple(range(1, len(chunk.shape)))
+            init_block = init_block - np.mean(
+                init_block, axis=other_axis, keepdims=True)
+        if out is None:
+            out = _output_array(chunk, False)
+        chunk_64 = np.asarray(chunk, dtype=np.float64)
+        out[:] = chunk_64 - self._running_mean(chunk_64)
+        if init_block is not None:
+            out[:len(init_block)] = init_block
+        self.n_samples += len(chunk)
+        return out
+
+    def _init_block(self, chunk):
+        if self.init_block_size is None:
+            return None
+        n_init = min(max(self.init_block_size - self.n_samples, 0),
+                     len(chunk))
+        if n_init == 0:
+            return None
+        return chunk[:n_init]
+
+
+class ExponentialRunningStandardizer(ExponentialRunningDemeaner):
+    """
+    Stateful exponential running standardization, see
+    exponential_running_standardize. Consecutive chunks of a recording, e.g.
+    read from disk or received live, are standardized as if the whole
+    recording was standardized at once.
+
+    Parameters
+    ----------
+    factor_new: float
+    init_block_size: int
+        Standardize data before to this index with regular standardization.
+    eps: float
+        Stabilizer for division by zero variance.
+    """
+    def __init__(self, factor_new=0.001, init_block_size=None, eps=1e-4):
+        self.eps = eps
+        super().__init__(factor_new=factor_new,
+                         init_block_size=init_block_size)
+
+    def reset(self):
+        super().reset()
+        self._running_var = _ExponentialRunningMean(self.factor_new)
+
+    def __call__(self, chunk, out=None):
+        """
+        Parameters
+        ----------
+        chunk: 2darray (time, channels)
+            Next chunk of the recording.
+        out: 2darray (time, channels), optional
+            Array the standardized chunk is written to, may be chunk itself.
+
+        Returns
+        -------
+        standardized: 2darray (time, channels)
+        """
+        init_block = self._init_block(chunk)
+        if init_block is not None:
+            other_axis = tuple(range(1, len(chunk.shape)))
+            init_mean = np.mean(init_block, axis=other_axis, keepdims=True)
+            init_std = np.std(init_block, axis=other_axis, keepdims=True)
+            init_block = (init_block - init_mean) / np.maximum(
+                self.eps, init_std)
+        if out is None:
+            out = _output_array(chunk, False)
+        chunk_64 = np.asarray(chunk, dtype=np.float64)
+        demeaned = chunk_64 - self._running_mean(chunk_64)
+        std = self._running_var(demeaned * demeaned)
+        np.sqrt(std, out=std)
+        np.maximum(std, self.eps, out=std)
+        out[:] = demeaned / std
+        if init_block is not None:
+            out[:len(init_block)] = init_block
+        self.n_samples += len(chunk)
+        return out
+
+
+def _output_array(data, inplace):
+    if inplace:
+        assert np.issubdtype(data.dtype, np.floating), (
+            "data has to be a float array to be overwritten")
+        return data
+    if data.dtype == np.float32:
+        return np.empty(data.shape, dtype=np.float32)
+    return np.empty(data.shape, dtype=np.float64)
+
+
+class _ExponentialRunningMean(object):
+    """Exponentially weighted mean over the first axis, equal to
+    pandas.DataFrame.ewm(alpha=factor_new).mean(), of consecutive chunks.
+
+    The weighted sum of all values so far is a first order IIR filter of the
+    data, whose state is carried over between chunks. The sum of the weights
+    has the closed form (1 - (1 - factor_new)^n) / factor_new.
+    """
+    def __init__(self, factor_new):
+        self.factor_new = factor_new
+        self.n_samples = 0
+        self.zi = None
+
+    def __call__(self, chunk):
+        if self.zi is None:
+            self.zi = np.zeros((1,) + chunk.shape[1:])
+        decay = 1 - self.factor_new
+        weighted_sum, self.zi = scipy.signal.lfilter(
+            [1.0], [1.0, -decay], chunk, axis=0, zi=self.zi)
+        n_samples = np.arange(
+            self.n_samples + 1, self.n_samples + len(chunk) + 1)
+        self.n_samples += len(chunk)
+        sum_of_weights = (1 - decay ** n_samples) / self.factor_new
+        weighted_sum /= sum_of_weights.reshape((-1,) + (1,) * (
+            chunk.ndim - 1))
+        return weighted_sum
+
+
 def highpass_cnt(data, low_cut_hz, fs, filt_order=3, axis=0):
     """
      Highpass signal applying **causal** butterworth filter of given order.
@@ -209,6 +361,165 @@ def bandpass_cnt(
     return data_bandpassed
 
 
+def sos_bandpass_cnt(data, low_cut_hz, high_cut_hz, fs, filt_order=3, axis=0,
+                     filtfilt=False, n_jobs=1):
+    """
+    Bandpass signal applying butterworth filter of given order in second
+    order sections, which is numerically more robust than bandpass_cnt for
+    high orders and low cutoffs. Filter designs are cached. Highpass or
+    lowpass only, as in bandpass_cnt, if one of the cutoffs is not given.
+
+    Parameters
+    ----------
+    data: 2d-array
+        Time x channels
+    low_cut_hz: float | None
+    high_cut_hz: float | None
+    fs: float
+    filt_order: int
+    axis: int
+        Time axis.
+    filtfilt: bool
+        Whether to use sosfiltfilt instead of sosfilt
+    n_jobs: int
+        Number of threads filtering separate channels in parallel, -1 uses
+        all cpus.
+
+    Returns
+    -------
+    bandpassed_data: 2d-array
+        Data after applying bandpass filter.
+    """
+    sos = _cached_butter_sos(filt_order, low_cut_hz, high_cut_hz, fs)
+    if sos is None:
+        log.info(
+            "Not doing any bandpass, since low 0 or None and "
+            "high None or nyquist frequency"
+        )
+        return data.copy()
+    filter_fn = scipy.signal.sosfiltfilt if filtfilt else scipy.signal.sosfilt
+    if n_jobs == 1:
+        return filter_fn(sos, data, axis=axis)
+    out = np.empty(data.shape, dtype=np.result_type(data.dtype, sos.dtype))
+    channel_axis = 1 if axis % data.ndim == 0 else 0
+    return _apply_to_channel_blocks(
+        lambda block: filter_fn(sos, block, axis=axis), data, out,
+        channel_axis, n_jobs)
+
+
+def _apply_to_channel_blocks(func, data, out, channel_axis, n_jobs):
+    """Apply func to blocks of channels of data in parallel threads and write
+    the results to the same channels of out. Useful for functions releasing
+    the GIL, like scipy's filters."""
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    n_channels = data.shape[channel_axis]
+    bounds = np.linspace(0, n_channels, min(n_jobs, n_channels) + 1).astype(
+        int)
+
+    def apply_to_block(i_start, i_stop):
+        channels = [slice(None)] * data.ndim
+        channels[channel_axis] = slice(i_start, i_stop)
+        channels = tuple(channels)
+        out[channels] = func(data[channels])
+
+    if len(bounds) <= 2:
+        apply_to_block(0, n_channels)
+        return out
+    with ThreadPoolExecutor(max_workers=len(bounds) - 1) as executor:
+        # consume the results to raise errors of the threads
+        list(executor.map(apply_to_block, bounds[:-1], bounds[1:]))
+    return out
+
+
+@lru_cache(maxsize=None)
+def _cached_butter_sos(filt_order, low_cut_hz, high_cut_hz, fs):
+    nyq_freq = 0.5 * fs
+    highpass = not (low_cut_hz is None or low_cut_hz == 0)
+    lowpass = not (high_cut_hz is None or high_cut_hz == nyq_freq)
+    if highpass and lowpass:
+        sos = scipy.signal.butter(
+            filt_order, [low_cut_hz / nyq_freq, high_cut_hz / nyq_freq],
+            btype="bandpass", output="sos")
+    elif highpass:
+        sos = scipy.signal.butter(
+            filt_order, low_cut_hz / nyq_freq, btype="highpass", output="sos")
+    elif lowpass:
+        sos = scipy.signal.butter(
+            filt_order, high_cut_hz / nyq_freq, btype="lowpass", output="sos")
+    else:
+        return None
+    return sos
+
+
+class CausalButterworthFilter(object):
+    """
+    Stateful **causal** butterworth filter, keeping the filter state between
+    calls. Consecutive chunks of a recording, e.g. read from disk or received
+    live, are filtered exactly as highpass_cnt, lowpass_cnt or bandpass_cnt
+    would filter the whole recording at once.
+
+    Parameters
+    ----------
+    low_cut_hz: float | None
+        Highpass with this cutoff, no highpass for 0 or None.
+    high_cut_hz: float | None
+        Lowpass with this cutoff, no lowpass for None or nyquist frequency.
+    fs: float
+    filt_order: int
+    axis: int
+        Time axis of the chunks.
+    """
+    def __init__(self, low_cut_hz, high_cut_hz, fs, filt_order=3, axis=0):
+        self.axis = axis
+        self.b, self.a = None, None
+        nyq_freq = 0.5 * fs
+        highpass = not (low_cut_hz is None or low_cut_hz == 0)
+        lowpass = not (high_cut_hz is None or high_cut_hz == nyq_freq)
+        if highpass and lowpass:
+            self.b, self.a = scipy.signal.butter(
+                filt_order, [low_cut_hz / nyq_freq, high_cut_hz / nyq_freq],
+                btype="bandpass")
+        elif highpass:
+            self.b, self.a = scipy.signal.butter(
+                filt_order, low_cut_hz / nyq_freq, btype="highpass")
+        elif lowpass:
+            self.b, self.a = scipy.signal.butter(
+                filt_order, high_cut_hz / nyq_freq, btype="lowpass")
+        else:
+            log.info("Not doing any filtering, since low 0 or None and "
+                     "high None or nyquist frequency")
+        if self.a is not None:
+            assert filter_is_stable(self.a), "Filter should be stable..."
+        self.reset()
+
+    def reset(self):
+        """Reset the filter state, to start a new recording."""
+        self.zi = None
+
+    def __call__(self, chunk):
+        """
+        Parameters
+        ----------
+        chunk: ndarray
+            Next chunk of the recording.
+
+        Returns
+        -------
+        filtered: ndarray
+            Filtered chunk.
+        """
+        if self.a is None:
+            return chunk.copy()
+        if self.zi is None:
+            zi_shape = list(chunk.shape)
+            zi_shape[self.axis] = max(len(self.a), len(self.b)) - 1
+            self.zi = np.zeros(zi_shape)
+        filtered, self.zi = scipy.signal.lfilter(
+            self.b, self.a, chunk, axis=self.axis, zi=self.zi)
+        return filtered
+
+
 def filter_is_stable(a):
     """
     Check if filter coefficients of IIR filter are stable.
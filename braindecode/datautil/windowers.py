@@ -8,18 +8,250 @@
 #
 # License: BSD (3-clause)
 
+import mmap
+import weakref
+
 import numpy as np
 import mne
 import pandas as pd
+from mne.annotations import _sync_onset
+
+
+class ArrayWindows(object):
+    """
+    Windows as zero-copy slices of continuous signals. A light-weight
+    alternative to mne.Epochs that keeps the continuous signals together with
+    a compact index of the windows instead of materializing every window.
+
+    Parameters
+    ----------
+    data: list(ndarray | QuantizedSignal)
+        continuous signals of shape (n_channels, n_times), one per recording
+    windows_ind: ndarray, shape (n_windows, 3)
+        (i_recording, start, stop) of every window in data
+    events: ndarray, shape (n_windows, 3)
+        mne-style events of the windows, last column holds the target
+    metadata: pandas.DataFrame
+        additional information about every window, stored as contiguous
+        columns in self.columns
+    targets: ndarray, shape (n_windows,) | (n_windows, n_targets) | None
+        targets of the windows. If None, the last column of events
+
+    Attributes
+    ----------
+    columns: dict(str, ndarray)
+        metadata columns of the windows
+    """
+    def __init__(self, data, windows_ind, events, metadata, targets=None):
+        self.data = data
+        self.windows_ind = np.asarray(windows_ind, dtype=np.int64)
+        self.events = np.asarray(events)
+        if targets is None:
+            targets = self.events[:, -1]
+        self.targets = np.ascontiguousarray(targets)
+        self.metadata = metadata
+
+    @property
+    def metadata(self):
+        """Metadata of the windows as pandas.DataFrame built from
+        self.columns."""
+        return pd.DataFrame(self.columns, copy=False)
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self.columns = {
+            column: np.ascontiguousarray(metadata[column].to_numpy())
+            for column in metadata.columns}
+
+    def get_window(self, index):
+        """Get a window as view of the continuous signal. Do not modify it
+        in-place, as this would modify the underlying signal. As in
+        get_windows, signals of reduced precision are returned as a float32
+        copy instead.
+        """
+        i_recording, start, stop = self.windows_ind[index]
+        window = self.data[i_recording][:, start:stop]
+        dtype = np.promote_types(window.dtype, np.float32)
+        if window.dtype != dtype:
+            window = window.astype(dtype)
+        return window
+
+    def get_windows(self, indices):
+        """Get windows stacked to an array of shape
+        (n_windows, n_channels, n_times), copying every window once. Signals
+        of reduced precision are returned as float32, dequantizing int16
+        signals while copying.
+        """
+        windows_ind = self.windows_ind[indices]
+        first_signal = self.data[windows_ind[0, 0]]
+        dtype = np.promote_types(
+            getattr(first_signal, "dtype", np.float64), np.float32)
+        X = np.empty((len(windows_ind), first_signal.shape[0],
+                      windows_ind[0, 2] - windows_ind[0, 1]), dtype=dtype)
+        for window, (i_recording, start, stop) in zip(X, windows_ind):
+            signal = self.data[i_recording]
+            if isinstance(signal, QuantizedSignal):
+                signal.dequantize(start, stop, out=window)
+            else:
+                window[:] = signal[:, start:stop]
+        return X
+
+    def __len__(self):
+        return len(self.windows_ind)
+
+    def __getstate__(self):
+        # do not pickle memory-mapped signals, but reopen them on unpickling,
+        # e.g. in DataLoader workers, such that pages are shared through the
+        # page cache
+        state = self.__dict__.copy()
+        state["data"] = [_memmap_to_file(d) for d in self.data]
+        return state
+
+    def __setstate__(self, state):
+        state["data"] = [_file_to_memmap(d) for d in state["data"]]
+        self.__dict__.update(state)
+
+
+class QuantizedSignal(object):
+    """
+    A continuous signal stored as int16 with a scale and offset per channel.
+    Can be sliced like an array of shape (n_channels, n_times), returning
+    float32.
+
+    Parameters
+    ----------
+    data: ndarray, shape (n_channels, n_times)
+        int16 signal
+    scale: ndarray, shape (n_channels,)
+        scale of every channel
+    offset: ndarray, shape (n_channels,)
+        offset of every channel
+    """
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, data, scale, offset):
+        self.data = data
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+
+    @classmethod
+    def quantize(cls, signal):
+        """Quantize a signal to int16, mapping the range of every channel
+        to [-32767, 32767].
+
+        Parameters
+        ----------
+        signal: ndarray, shape (n_channels, n_times)
+
+        Returns
+        -------
+        quantized: QuantizedSignal
+        """
+        minimum, maximum = signal.min(axis=1), signal.max(axis=1)
+        offset = (maximum + minimum) / 2
+        scale = (maximum - minimum) / (2 * 32767)
+        # constant channels
+        scale[scale == 0] = 1
+        data = np.rint((signal - offset[:, None]) / scale[:, None])
+        return cls(np.clip(data, -32767, 32767).astype(np.int16), scale,
+                   offset)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __getitem__(self, item):
+        channels = item[0] if isinstance(item, tuple) else item
+        return (self.data[item] * self.scale[channels][..., None] +
+                self.offset[channels][..., None])
+
+    def dequantize(self, start, stop, out):
+        """Dequantize samples start to stop of all channels into out."""
+        np.multiply(self.data[:, start:stop], self.scale[:, None], out=out)
+        out += self.offset[:, None]
+        return out
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["data"] = _memmap_to_file(self.data)
+        return state
+
+    def __setstate__(self, state):
+        state["data"] = _file_to_memmap(state["data"])
+        self.__dict__.update(state)
+
+
+def convert_signal(signal, dtype):
+    """Convert a continuous signal to a storage dtype.
+
+    Parameters
+    ----------
+    signal: ndarray, shape (n_channels, n_times)
+        continuous signal
+    dtype: str | numpy.dtype
+        float32, float16 or int16, which quantizes the signal
+
+    Returns
+    -------
+    signal: ndarray | QuantizedSignal
+    """
+    dtype = np.dtype(dtype)
+    assert dtype in [np.float32, np.float16, np.int16], (
+        f"unsupported storage dtype {dtype}")
+    if dtype == np.int16:
+        return QuantizedSignal.quantize(signal)
+    return signal.astype(dtype)
+
+
+class _MemmapFile(object):
+    def __init__(self, filename, mode, offset, shape):
+        self.filename = filename
+        self.mode = mode
+        self.offset = offset
+        self.shape = shape
+
+
+# memory-mapped files opened in this process, such that every file is only
+# opened once when many signals of the same file are unpickled
+_open_memmaps = weakref.WeakValueDictionary()
+
+
+def _memmap_to_file(d):
+    # memory-mapped signals may be contiguous views of a larger file
+    if not isinstance(d, np.memmap) or not d.flags.c_contiguous:
+        return d
+    root = d
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap) or not isinstance(
+            root.base, mmap.mmap):
+        return d
+    offset = (d.__array_interface__["data"][0] -
+              root.__array_interface__["data"][0]) // d.itemsize
+    return _MemmapFile(root.filename, root.mode, offset, d.shape)
+
+
+def _file_to_memmap(d):
+    if not isinstance(d, _MemmapFile):
+        return d
+    key = (d.filename, d.mode)
+    root = _open_memmaps.get(key)
+    if root is None:
+        root = np.load(d.filename, mmap_mode=d.mode)
+        _open_memmaps[key] = root
+    size = int(np.prod(d.shape))
+    return root.reshape(-1)[d.offset:d.offset + size].reshape(d.shape)
 
 
 class Windower(object):
     """
-    A windower that creates a mne Epochs objects.
+    A windower that creates a mne Epochs objects or, if use_mne_epochs is
+    False, ArrayWindows.
     """
     def __init__(self, trial_start_offset_samples, trial_stop_offset_samples,
                  supercrop_size_samples, supercrop_stride_samples,
-                 drop_samples=False, mapping=None):
+                 drop_samples=False, mapping=None, use_mne_epochs=True,
+                 dtype=None):
         self.trial_start_offset_samples = trial_start_offset_samples
         self.trial_stop_offset_samples = trial_stop_offset_samples
         assert supercrop_size_samples > 0, (
@@ -30,11 +262,21 @@ class Windower(object):
         self.stride = supercrop_stride_samples
         self.drop_samples = drop_samples
         self.mapping = mapping
+        self.use_mne_epochs = use_mne_epochs
+        assert dtype is None or not use_mne_epochs, (
+            "storage dtypes are only supported with use_mne_epochs=False")
+        self.dtype = dtype
         # TODO: assert values are integers
         # TODO: assert start < stop
 
     # TODO: handle case we don't get a raw
-    def __call__(self, raw, events, metadata):
+    def __call__(self, raw, events, metadata, targets=None):
+        if not self.use_mne_epochs:
+            return _create_array_windows(
+                raw, events, metadata, self.size, targets=targets,
+                dtype=self.dtype)
+        assert targets is None, (
+            "several targets are only supported with use_mne_epochs=False")
         # supercrop size - 1, since tmax is inclusive
         return mne.Epochs(raw, events, baseline=None,
                           tmin=0, tmax=(self.size-1)/raw.info["sfreq"],
@@ -69,6 +311,13 @@ class EventWindower(Windower):
         supercrops/windows do not equally devide the continuous signal
     mapping: dict(str: int)
         mapping from event description to target value
+    use_mne_epochs: bool
+        if False, create ArrayWindows that slice the preloaded continuous
+        signal instead of mne.Epochs
+    dtype: str | None
+        storage dtype of the continuous signal of ArrayWindows, float32,
+        float16 or int16 with a scale and offset per channel. If None, the
+        signal of the preloaded raw is used
     """
     def __call__(self, base_ds):
         events = mne.find_events(base_ds.raw)
@@ -78,9 +327,8 @@ class EventWindower(Windower):
             onsets, self.trial_start_offset_samples,
             self.trial_stop_offset_samples, self.size, self.stride,
             self.drop_samples)
-        events = [[start, self.size, description[i_trials[i_start]]]
-                  for i_start, start in enumerate(starts)]
-        events = np.array(events)
+        events = np.stack([starts, np.full(len(starts), self.size),
+                           description[i_trials]], axis=1)
         assert (np.diff(events[:,0]) > 0).all(), (
             "trials overlap not implemented")
         description = events[:, -1]
@@ -100,7 +348,9 @@ class EventWindower(Windower):
 class FixedLengthWindower(Windower):
     """
     A Windower that creates supercrops/windows based on fake events that equally
-    divide the continuous signal.
+    divide the continuous signal. Supercrops start every stride samples as
+    long as they fit into the signal, as in _supercrop_starts. Unless
+    drop_samples, a last supercrop is added that ends with the signal.
 
     Parameters
     ----------
@@ -116,37 +366,259 @@ class FixedLengthWindower(Windower):
         whether or not have a last overlapping supercrop/window, when
         supercrops/windows do not equally devide the continuous signal
     mapping: dict(str: int)
-        mapping from event description to target value
+        mapping from target value to int, required for targets that are not
+        integers
+    use_mne_epochs: bool
+        if False, create ArrayWindows that slice the preloaded continuous
+        signal instead of mne.Epochs. Required for several targets
+    dtype: str | None
+        storage dtype of the continuous signal of ArrayWindows, float32,
+        float16 or int16 with a scale and offset per channel. If None, the
+        signal of the preloaded raw is used
     """
     def __call__(self, base_ds):
-        # already includes last incomplete supercrop start
-        starts = np.arange(0, base_ds.raw.n_times, self.stride)
-        # 1/0
-        if self.drop_samples:
-            starts = starts[:-1]
-        else:
-            # if last supercrop does not end at trial stop, make it stop
-            # there
-            if starts[-1] != base_ds.raw.n_times - self.size:
-                starts[-1] = base_ds.raw.n_times - self.size
-
-        # TODO: handle multi-target case
-        assert len(base_ds.info[base_ds.target]) == 1, (
-            "multi-target not supported")
-        description = base_ds.info[base_ds.target].iloc[0]
+        raw = base_ds.raw
+        events, metadata, targets = self.create_index(
+            raw.n_times, base_ds.info, base_ds.target,
+            first_samp=raw.first_samp)
+        return super().__call__(raw, events, metadata, targets=targets)
+
+    def create_index(self, n_times, info, target, first_samp=0):
+        """Create events and metadata of the supercrops of a recording,
+        without accessing its signal.
+
+        Parameters
+        ----------
+        n_times: int
+            number of samples of the recording
+        info: pandas.DataFrame
+            info of the recording with a single row holding the target(s)
+        target: str | list(str)
+            column(s) of info to be used as target(s)
+        first_samp: int
+            first sample of the recording, as mne.io.Raw.first_samp
+
+        Returns
+        -------
+        events: ndarray, shape (n_supercrops, 3)
+            mne-style events of the supercrops, the last column holds the
+            target or 0 in case of several targets
+        metadata: pandas.DataFrame
+            i_supercrop_in_trial, i_start_in_trial, i_stop_in_trial and, in
+            case of a single target, target of the supercrops
+        targets: ndarray, shape (n_supercrops, n_targets) | None
+            targets of the supercrops in case of several targets
+        """
+        assert len(info) == 1, "info has to hold a single recording"
+        _, i_supercrop_in_trials, starts, stops = _supercrop_starts(
+            np.array([0]), 0, n_times, self.size, self.stride,
+            self.drop_samples)
+        n_supercrops = len(starts)
+        several_targets = not isinstance(target, str)
+        target_values = [
+            self._map_target(info[t].iloc[0])
+            for t in (target if several_targets else [target])]
+        events = np.stack([
+            starts + first_samp, np.full(n_supercrops, self.size),
+            np.full(n_supercrops, 0 if several_targets else target_values[0])],
+            axis=1)
+        metadata = pd.DataFrame({
+            "i_supercrop_in_trial": i_supercrop_in_trials,
+            "i_start_in_trial": starts,
+            "i_stop_in_trial": stops})
+        if several_targets:
+            return events, metadata, np.tile(target_values, (n_supercrops, 1))
+        metadata["target"] = events[:, -1]
+        return events, metadata, None
+
+    def _map_target(self, value):
         # https://github.com/numpy/numpy/issues/2951
-        if not isinstance(description, np.integer):
+        if not isinstance(value, np.integer):
             assert self.mapping is not None, (
-                f"a mapping from '{description}' to int is required")
-            description = self.mapping[description]
-        events = [[start, self.size, description]
-                  for i_start, start in enumerate(starts)]
-        metadata = pd.DataFrame(
-            zip(np.arange(len(events)), starts, starts + self.size,
-                len(events) *[description]),
-            columns=["i_supercrop_in_trial", "i_start_in_trial",
-                     "i_stop_in_trial", "target"])
-        return super().__call__(base_ds.raw, events, metadata=metadata)
+                f"a mapping from '{value}' to int is required")
+            value = self.mapping[value]
+        return value
+
+
+class StreamingWindower(object):
+    """
+    A windower for unbounded continuous input, e.g. in online decoding.
+    Chunks of samples are written to a ring buffer and supercrops are
+    returned as soon as their last sample arrived. Supercrops are placed as
+    by FixedLengthWindower with drop_samples=True, i.e. the i-th supercrop
+    spans samples i * stride to i * stride + size of the stream.
+
+    Every sample is written twice to a buffer of twice the supercrop size,
+    such that every supercrop is a contiguous view of the buffer. Windowing
+    chunks with __call__ yields these views without allocating memory after
+    initialization, push returns copies.
+
+    Parameters
+    ----------
+    n_channels: int
+        number of channels of the stream
+    supercrop_size_samples: int
+        supercrop size
+    supercrop_stride_samples: int
+        stride between supercrops
+    dtype: numpy.dtype
+        dtype of the buffer
+    """
+    def __init__(self, n_channels, supercrop_size_samples,
+                 supercrop_stride_samples, dtype=np.float64):
+        assert supercrop_size_samples > 0, (
+            "supercrop size has to be larger than 0")
+        assert supercrop_stride_samples > 0, (
+            "supercrop stride has to be larger than 0")
+        self.n_channels = n_channels
+        self.size = supercrop_size_samples
+        self.stride = supercrop_stride_samples
+        self._buffer = np.zeros((n_channels, 2 * self.size), dtype=dtype)
+        self._n_seen = 0
+        self._i_supercrop = 0
+
+    def push(self, chunk):
+        """Add a chunk of samples to the stream and return the supercrops
+        completed by it. The whole chunk is written immediately.
+
+        Parameters
+        ----------
+        chunk: ndarray, shape (n_channels, n_times)
+            next samples of the stream
+
+        Returns
+        -------
+        supercrops: ndarray, shape (n_supercrops, n_channels, supercrop_size)
+            copies of the completed supercrops, possibly none
+        ind: ndarray, shape (n_supercrops, 3)
+            i_supercrop_in_trial, i_start_in_trial and i_stop_in_trial of the
+            supercrops in the stream
+        """
+        n_complete = max(0, (self._n_seen + np.shape(chunk)[1] - self.size) //
+                         self.stride + 1)
+        n_supercrops = max(0, n_complete - self._i_supercrop)
+        supercrops = np.empty(
+            (n_supercrops, self.n_channels, self.size),
+            dtype=self._buffer.dtype)
+        ind = np.empty((n_supercrops, 3), dtype=np.int64)
+        for i, (supercrop, supercrop_ind) in enumerate(self._push(chunk)):
+            supercrops[i] = supercrop
+            ind[i] = supercrop_ind
+        return supercrops, ind
+
+    def __call__(self, chunks):
+        """Window an iterable of chunks, yielding every supercrop as soon as
+        its last sample arrived.
+
+        Chunks are written while iterating, so samples of a chunk after the
+        last requested supercrop are only written once the next supercrop
+        is requested. Stopping the iteration early stops the stream there.
+
+        Parameters
+        ----------
+        chunks: iterable of ndarray, shape (n_channels, n_times)
+
+        Yields
+        ------
+        supercrop: ndarray, shape (n_channels, supercrop_size_samples)
+            view of the ring buffer, only valid until the next supercrop is
+            requested. Copy it to keep it.
+        ind: tuple(int)
+            i_supercrop_in_trial, i_start_in_trial and i_stop_in_trial of the
+            supercrop in the stream
+        """
+        for chunk in chunks:
+            yield from self._push(chunk)
+
+    def _push(self, chunk):
+        chunk = np.asarray(chunk)
+        assert chunk.ndim == 2 and chunk.shape[0] == self.n_channels, (
+            f"chunks have to be of shape ({self.n_channels}, n_times)")
+        i_sample = 0
+        while i_sample < chunk.shape[1]:
+            stop = self._i_supercrop * self.stride + self.size
+            n_samples = min(chunk.shape[1] - i_sample,
+                            stop - self._n_seen, self.size)
+            self._write(chunk[:, i_sample:i_sample + n_samples])
+            i_sample += n_samples
+            if self._n_seen == stop:
+                start = stop % self.size
+                yield (self._buffer[:, start:start + self.size],
+                       (self._i_supercrop, stop - self.size, stop))
+                self._i_supercrop += 1
+
+    def _write(self, samples):
+        # write samples to their position in both halves of the buffer,
+        # wrapping around at the end of the first half
+        n_samples = samples.shape[1]
+        position = self._n_seen % self.size
+        n_to_end = min(n_samples, self.size - position)
+        for offset in [0, self.size]:
+            self._buffer[:, offset + position:
+                         offset + position + n_to_end] = samples[:, :n_to_end]
+            self._buffer[:, offset:offset + n_samples - n_to_end] = (
+                samples[:, n_to_end:])
+        self._n_seen += n_samples
+
+
+def _create_array_windows(raw, events, metadata, size, targets=None,
+                          dtype=None):
+    """Create ArrayWindows from events, which mark the window starts in raw.
+    Preloads the raw, if it is not preloaded already and no storage dtype is
+    given. Otherwise, the signal is read without preloading, such that only
+    the converted signal is kept in memory.
+    """
+    if dtype is not None:
+        signal = convert_signal(
+            raw._data if raw.preload else raw.get_data(), dtype)
+    else:
+        if not raw.preload:
+            raw.load_data()
+        signal = raw._data
+    return _array_windows_from_events(
+        signal, raw.n_times, events, metadata, size,
+        first_samp=raw.first_samp, targets=targets,
+        bad_segments=_bad_segments(raw))
+
+
+def _bad_segments(raw):
+    """Start and stop in samples of the segments of raw annotated as bad, as
+    rejected by mne.Epochs with reject_by_annotation=True."""
+    annotations = raw.annotations
+    is_bad = np.array([description.lower().startswith("bad")
+                       for description in annotations.description], bool)
+    if not is_bad.any():
+        return np.empty((0, 2))
+    onsets = _sync_onset(raw, annotations.onset[is_bad])
+    stops = onsets + annotations.duration[is_bad]
+    return np.stack([onsets, stops], axis=1) * raw.info["sfreq"]
+
+
+def _array_windows_from_events(signal, n_times, events, metadata, size,
+                               first_samp=0, targets=None, bad_segments=None):
+    """Create ArrayWindows of a single continuous signal, which can be
+    anything that supports slicing [:, start:stop]. Windows overlapping
+    bad_segments, start and stop in samples relative to the first sample,
+    are dropped.
+    """
+    events = np.asarray(events)
+    # events are given with respect to the first sample of the recording
+    starts = events[:, 0] - first_samp
+    stops = starts + size
+    # as mne.Epochs, drop windows that do not fit into the signal or overlap
+    # segments annotated as bad
+    in_bounds = (starts >= 0) & (stops <= n_times)
+    if bad_segments is not None and len(bad_segments) > 0:
+        in_bounds &= ~(
+            (bad_segments[:, 0] < stops[:, None]) &
+            (bad_segments[:, 1] > starts[:, None])).any(axis=1)
+    windows_ind = np.stack([np.zeros(in_bounds.sum(), dtype=np.int64),
+                            starts[in_bounds], stops[in_bounds]], axis=1)
+    metadata = metadata[in_bounds].reset_index(drop=True)
+    if targets is not None:
+        targets = targets[in_bounds]
+    return ArrayWindows([signal], windows_ind, events[in_bounds], metadata,
+                        targets=targets)
 
 
 # TODO: name should reflect what function is doing
@@ -173,35 +645,33 @@ def _supercrop_starts(onsets, start_offset, stop_offset, size, stride,
 
     Returns
     -------
+    i_trials: ndarray
+        trial index of every supercrop
+    i_supercrop_in_trials: ndarray
+        index of every supercrop within its trial
+    starts: ndarray
+        supercrop starts
+    stops: ndarray
+        supercrop stops
     """
-    # trial ends are defined by trial starts (onsets maybe shifted by offset)
-    # and end
-    stops = onsets + stop_offset
-    i_supercrop_in_trials, i_trials, starts = [], [], []
-    for onset_i, onset in enumerate(onsets):
-        # between original trial onsets (shifted by start_offset) and stops,
-        # generate possible supercrop starts with given stride
-        possible_starts = np.arange(
-            onset+start_offset, onset+stop_offset, stride)
-
-        # possible supercrop start is actually a start, if supercrop size fits
-        # in trial start and stop
-        for i_supercrop, s in enumerate(possible_starts):
-            if (s + size) <= stops[onset_i]:
-                starts.append(s)
-                i_supercrop_in_trials.append(i_supercrop)
-                i_trials.append(onset_i)
-
-        # if the last supercrop start + supercrop size is not the same as
-        # onset + stop_offset, create another supercrop that overlaps and stops
-        # at onset + stop_offset
-        if not drop_samples:
-            if starts[-1] + size != onset + stop_offset:
-                starts.append(onset + stop_offset - size)
-                i_supercrop_in_trials.append(i_supercrop_in_trials[-1] + 1)
-                i_trials.append(onset_i)
-
-    # update stops to now be event stops instead of trial stops
-    stops = np.array(starts) + size
+    onsets = np.asarray(onsets)
+    # all trials span the same number of samples relative to their onsets,
+    # so supercrop starts relative to onsets are the same for every trial.
+    # a possible supercrop start is actually a start, if supercrop size fits
+    # in trial start and stop
+    n_fitting = max(0, int((stop_offset - start_offset - size) // stride) + 1)
+    rel_starts = start_offset + stride * np.arange(n_fitting)
+    # if the last supercrop start + supercrop size is not the same as
+    # onset + stop_offset, create another supercrop that overlaps and stops
+    # at onset + stop_offset
+    if (not drop_samples and n_fitting > 0 and
+            rel_starts[-1] + size != stop_offset):
+        rel_starts = np.append(rel_starts, stop_offset - size)
+
+    n_per_trial = len(rel_starts)
+    i_trials = np.repeat(np.arange(len(onsets)), n_per_trial)
+    i_supercrop_in_trials = np.tile(np.arange(n_per_trial), len(onsets))
+    starts = (onsets[:, None] + rel_starts[None, :]).ravel()
+    stops = starts + size
     assert len(i_supercrop_in_trials) == len(starts) == len(stops)
     return i_trials, i_supercrop_in_trials, starts, stops
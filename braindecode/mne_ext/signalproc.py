@@ -1,11 +1,14 @@
 import logging
 from copy import deepcopy
+from fractions import Fraction
 
-import resampy
 import numpy as np
+import scipy.signal
 from mne.io.base import concatenate_raws
 import mne
 
+from ..datautil.signalproc import _apply_to_channel_blocks
+
 log = logging.getLogger(__name__)
 
 
@@ -31,15 +34,23 @@ def concatenate_raws_with_events(raws):
     return new_raw
 
 
-def resample_cnt(cnt, new_fs):
+def resample_cnt(cnt, new_fs, chunk_size=100000, n_jobs=1):
     """
-    Resample continuous recording using `resampy`.
+    Resample continuous recording with a polyphase filter, see
+    `scipy.signal.resample_poly`. The recording is read and resampled in
+    float32 chunks, so it does not have to be preloaded.
 
     Parameters
     ----------
-    cnt: `mne.io.RawArray`
+    cnt: `mne.io.Raw`
     new_fs: float
-        New sampling rate.
+        New sampling rate, the ratio to the old sampling rate has to be a
+        fraction with a denominator of at most 1000.
+    chunk_size: int
+        Number of time points resampled at once.
+    n_jobs: int
+        Number of threads resampling separate channels in parallel, -1 uses
+        all cpus.
 
     Returns
     -------
@@ -56,20 +67,81 @@ def resample_cnt(cnt, new_fs):
     log.info(
         "Resampling from {:f} to {:f} Hz.".format(cnt.info["sfreq"], new_fs)
     )
+    old_fs = cnt.info["sfreq"]
+    ratio = _resample_ratio(old_fs, new_fs)
+    new_data = _resample_poly_in_chunks(
+        lambda i_start, i_stop: cnt.get_data(start=i_start, stop=i_stop),
+        len(cnt.ch_names), cnt.n_times, ratio.numerator, ratio.denominator,
+        chunk_size, n_jobs)
+    return mne.io.RawArray(new_data, _resampled_info(cnt.info, new_fs))
 
-    data = cnt.get_data().T
 
-    new_data = resampy.resample(
-        data, cnt.info["sfreq"], new_fs, axis=0, filter="kaiser_fast"
-    ).T
-    old_fs = cnt.info["sfreq"]
-    new_info = deepcopy(cnt.info)
-    new_info["sfreq"] = new_fs
-    events = new_info["events"]
-    event_samples_old = cnt.info["events"][:, 0]
-    event_samples = event_samples_old * new_fs / float(old_fs)
-    events[:, 0] = event_samples
-    return mne.io.RawArray(new_data, new_info)
+def _resample_ratio(old_fs, new_fs):
+    ratio = Fraction(new_fs / float(old_fs)).limit_denominator(1000)
+    assert np.isclose(old_fs * ratio, new_fs, rtol=1e-9, atol=0), (
+        "Ratio of sampling rates {:f} / {:f} is not a fraction with a "
+        "denominator of at most 1000".format(new_fs, old_fs))
+    return ratio
+
+
+def _resampled_info(info, new_fs):
+    """Copy of info with the new sampling rate and, if info holds an events
+    array, event samples moved to the new sampling rate."""
+    new_info = deepcopy(info)
+    # newer mne versions only allow to set the sampling rate when unlocked
+    if hasattr(new_info, "_unlock"):
+        with new_info._unlock():
+            new_info["sfreq"] = new_fs
+    else:
+        new_info["sfreq"] = new_fs
+    events = new_info.get("events")
+    if isinstance(events, np.ndarray):
+        events[:, 0] = info["events"][:, 0] * new_fs / float(info["sfreq"])
+    return new_info
+
+
+def _resample_poly_n_context(up, down):
+    """Number of input samples on both sides of a chunk covering the default
+    filter of scipy.signal.resample_poly, a multiple of down."""
+    half_len = 10 * max(up, down)
+    return int(np.ceil((half_len // up + 2) / down)) * down
+
+
+def _resample_poly_chunk(chunk, i_chunk_start, i_start, up, down, out,
+                         n_jobs):
+    """Resample chunk, which starts at input sample i_chunk_start, into out,
+    the output from input sample i_start on. Both have to be multiples of
+    down, i.e. start exactly at output samples."""
+    i_keep_start = (i_start - i_chunk_start) * up // down
+    i_keep_stop = i_keep_start + out.shape[1]
+    _apply_to_channel_blocks(
+        lambda block: scipy.signal.resample_poly(
+            block, up, down, axis=1)[:, i_keep_start:i_keep_stop],
+        chunk.astype(np.float32), out, 0, n_jobs)
+
+
+def _resample_poly_in_chunks(get_chunk, n_channels, n_times, up, down,
+                             chunk_size, n_jobs):
+    """Resample chunks of a signal of shape (n_channels, n_times), read with
+    get_chunk(i_start, i_stop), with scipy.signal.resample_poly and its
+    default filter. Every chunk is extended by enough input samples on both
+    sides to cover the filter, so the result equals resampling the whole
+    signal at once, up to float32 precision."""
+    # chunks start at multiples of down, i.e. exactly at output samples
+    chunk_size = max(chunk_size // down, 1) * down
+    n_context = _resample_poly_n_context(up, down)
+    n_out = int(np.ceil(n_times * up / down))
+    new_data = np.empty((n_channels, n_out))
+    for i_start in range(0, n_times, chunk_size):
+        i_stop = min(i_start + chunk_size, n_times)
+        i_context_start = max(i_start - n_context, 0)
+        i_context_stop = min(i_stop + n_context, n_times)
+        i_out_start = i_start * up // down
+        i_out_stop = i_stop * up // down if i_stop < n_times else n_out
+        _resample_poly_chunk(
+            get_chunk(i_context_start, i_context_stop), i_context_start,
+            i_start, up, down, new_data[:, i_out_start:i_out_stop], n_jobs)
+    return new_data
 
 
 def mne_apply(func, raw, verbose="WARNING"):
@@ -93,6 +165,205 @@ def mne_apply(func, raw, verbose="WARNING"):
     return mne.io.RawArray(new_data, raw.info, verbose=verbose)
 
 
+def mne_apply_chunked(funcs, raw, chunk_size=10000, out_path=None,
+                      verbose="WARNING"):
+    """
+    Apply functions one after the other to data of `mne.io.Raw`, streaming
+    the recording through them in chunks of time. The recording is read
+    chunk by chunk, so it does not have to be preloaded, and the result can
+    be written to a memory-mapped file. Peak memory is then bounded by the
+    chunk size instead of the recording length.
+
+    Functions are applied to every chunk separately, which is exact for
+    functions of single time points, e.g. common average reference, and for
+    stateful causal functions, e.g.
+    :class:`braindecode.datautil.signalproc.CausalButterworthFilter` with
+    axis=1. Non-causal functions, e.g. zero-phase filters, have to be wrapped
+    in :class:`ContextFunction`. Recordings are resampled by a
+    :class:`ResampleFunction`, functions after it get chunks at the new
+    sampling rate.
+
+    Parameters
+    ----------
+    funcs: list of function | ContextFunction | ResampleFunction
+        Should accept 2d-array (channels x time) and return modified 2d-array
+        with the same number of time points
+    raw: `mne.io.Raw`
+    chunk_size: int
+        Number of time points per chunk.
+    out_path: str | None
+        Path of a .npy file the transformed data is memory-mapped to. If None,
+        data is kept in memory.
+    verbose: bool
+        Whether to log creation of new `mne.io.RawArray`.
+
+    Returns
+    -------
+    transformed_set: `mne.io.RawArray` with data transformed by given
+        functions.
+    """
+    chunks = (raw.get_data(start=i_start, stop=i_start + chunk_size)
+              for i_start in range(0, raw.n_times, chunk_size))
+    # chunks are only read when writing the output, so sampling rate and
+    # length of the output are known beforehand
+    sfreq = raw.info["sfreq"]
+    n_times = int(raw.n_times)
+    for func in funcs:
+        if isinstance(func, ResampleFunction):
+            chunks = func.apply_to_chunks(chunks, sfreq)
+            n_times = func.n_resampled_times(n_times, sfreq)
+            sfreq = func.new_fs
+        elif isinstance(func, ContextFunction):
+            chunks = func.apply_to_chunks(chunks)
+        else:
+            chunks = map(func, chunks)
+    shape = (len(raw.ch_names), n_times)
+    if out_path is None:
+        new_data = np.empty(shape)
+    else:
+        new_data = np.lib.format.open_memmap(
+            out_path, mode="w+", dtype=np.float64, shape=shape)
+    i_start = 0
+    for chunk in chunks:
+        new_data[:, i_start:i_start + chunk.shape[1]] = chunk
+        i_start += chunk.shape[1]
+    assert i_start == n_times, (
+        "Functions besides ResampleFunction have to keep the length of time")
+    info = raw.info
+    if sfreq != info["sfreq"]:
+        info = _resampled_info(info, sfreq)
+    return mne.io.RawArray(new_data, info, verbose=verbose)
+
+
+class ContextFunction(object):
+    """
+    Function of 2d-arrays (channels x time), whose output at a time point
+    depends on up to n_context past and future time points, e.g. a zero-phase
+    filter. Applied to chunks by :func:`mne_apply_chunked`, each chunk is
+    extended by n_context time points of the neighbouring chunks on both
+    sides, which are removed from the output again. Output of chunks is
+    therefore delayed until n_context future time points are available.
+
+    Parameters
+    ----------
+    func: function
+        Should accept 2d-array (channels x time) and return modified 2d-array
+        with the same number of time points
+    n_context: int
+        Number of past and future time points needed for the output. For
+        infinite impulse responses, the number of time points after which the
+        response is negligible.
+    """
+    def __init__(self, func, n_context):
+        self.func = func
+        self.n_context = n_context
+
+    def __call__(self, a):
+        return self.func(a)
+
+    def apply_to_chunks(self, chunks):
+        """
+        Parameters
+        ----------
+        chunks: iterable of 2darray (channels x time)
+
+        Yields
+        ------
+        chunk: 2darray (channels x time)
+            Transformed chunks, of different lengths than the given chunks.
+        """
+        # buffer holds the data from n_context time points before the first
+        # time point without output
+        buffer = None
+        n_done = 0
+        for chunk in chunks:
+            buffer = chunk if buffer is None else np.concatenate(
+                (buffer, chunk), axis=1)
+            n_new = buffer.shape[1] - n_done - self.n_context
+            if n_new > 0:
+                yield self.func(buffer)[:, n_done:n_done + n_new]
+                n_drop = max(n_done + n_new - self.n_context, 0)
+                buffer = buffer[:, n_drop:]
+                n_done = n_done + n_new - n_drop
+        if buffer is not None and buffer.shape[1] > n_done:
+            yield self.func(buffer)[:, n_done:]
+
+
+class ResampleFunction(object):
+    """
+    Resampling step of :func:`mne_apply_chunked`, resampling with a
+    polyphase filter like :func:`resample_cnt`. Chunks are extended by
+    enough time points of the neighbouring chunks to cover the filter, so
+    the result equals resampling the whole recording at once, up to float32
+    precision. Output of chunks is therefore delayed until these future time
+    points are available.
+
+    Parameters
+    ----------
+    new_fs: float
+        New sampling rate, the ratio to the old sampling rate has to be a
+        fraction with a denominator of at most 1000.
+    n_jobs: int
+        Number of threads resampling separate channels in parallel, -1 uses
+        all cpus.
+    """
+    def __init__(self, new_fs, n_jobs=1):
+        self.new_fs = new_fs
+        self.n_jobs = n_jobs
+
+    def n_resampled_times(self, n_times, old_fs):
+        """Number of time points after resampling n_times time points."""
+        ratio = _resample_ratio(old_fs, self.new_fs)
+        return int(np.ceil(n_times * ratio.numerator / ratio.denominator))
+
+    def apply_to_chunks(self, chunks, old_fs):
+        """
+        Parameters
+        ----------
+        chunks: iterable of 2darray (channels x time)
+        old_fs: float
+            Sampling rate of the chunks.
+
+        Yields
+        ------
+        chunk: 2darray (channels x time)
+            Resampled chunks, of different lengths than the given chunks.
+        """
+        ratio = _resample_ratio(old_fs, self.new_fs)
+        up, down = ratio.numerator, ratio.denominator
+        n_context = _resample_poly_n_context(up, down)
+        # buffer holds the data from i_buffer_start on, which is n_context
+        # time points before the first time point without output, i_done
+        buffer = None
+        i_buffer_start = 0
+        i_done = 0
+        for chunk in chunks:
+            buffer = chunk if buffer is None else np.concatenate(
+                (buffer, chunk), axis=1)
+            i_buffer_stop = i_buffer_start + buffer.shape[1]
+            i_stop = (i_buffer_stop - n_context) // down * down
+            if i_stop > i_done:
+                out = np.empty(
+                    (buffer.shape[0], (i_stop - i_done) * up // down))
+                _resample_poly_chunk(
+                    buffer[:, :i_stop + n_context - i_buffer_start],
+                    i_buffer_start, i_done, up, down, out, self.n_jobs)
+                yield out
+                i_done = i_stop
+                i_drop = max(i_done - n_context, 0)
+                buffer = buffer[:, i_drop - i_buffer_start:]
+                i_buffer_start = i_drop
+        if buffer is not None:
+            n_times = i_buffer_start + buffer.shape[1]
+            n_out = int(np.ceil(n_times * up / down))
+            if n_out > i_done * up // down:
+                out = np.empty((buffer.shape[0], n_out - i_done * up // down))
+                _resample_poly_chunk(
+                    buffer, i_buffer_start, i_done, up, down, out,
+                    self.n_jobs)
+                yield out
+
+
 def common_average_reference_cnt(cnt,):
     """
     Common average reference, subtract average over electrodes at each timestep.
@@ -107,4 +378,4 @@ def common_average_reference_cnt(cnt,):
         Same data after common average reference.
     """
 
-    return mne_apply(lambda a: a - np.mean(a, axis=0, keepdim=True), cnt)
+    return mne_apply(lambda a: a - np.mean(a, axis=0, keepdims=True), cnt)
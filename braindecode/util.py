@@ -203,7 +203,7 @@ def add_message_to_exception(exc, additional_message):
         arg0 = ""
     else:
 
-        arg0 = args[0]
+        arg0 = str(args[0])
     arg0 += additional_message
     exc.args = (arg0,) + args[1:]
 
@@ -286,7 +286,7 @@ def select_inverse_inds(arr, inds):
 
 
 def get_balanced_batches(
-    n_trials, rng, shuffle, n_batches=None, batch_size=None
+    n_trials, rng, shuffle, n_batches=None, batch_size=None, lazy=False
 ):
     """Create indices for batches balanced in size
     (batches will have maximum size difference of 1).
@@ -303,39 +303,39 @@ def get_balanced_batches(
         Whether to shuffle indices before splitting set.
     n_batches : int, optional
     batch_size : int, optional
+    lazy : bool, optional
+        Whether to return a generator yielding the batches one by one
+        instead of a list.
 
     Returns
     -------
-    batches: list of list of int
-        Indices for each batch.
+    batches: list of 1darray of int | generator
+        Indices for each batch, views of one array of all indices.
     """
     assert batch_size is not None or n_batches is not None
     if n_batches is None:
         n_batches = int(np.round(n_trials / float(batch_size)))
+    n_batches = max(n_batches, 1)
 
-    if n_batches > 0:
-        min_batch_size = n_trials // n_batches
-        n_batches_with_extra_trial = n_trials % n_batches
-    else:
-        n_batches = 1
-        min_batch_size = n_trials
-        n_batches_with_extra_trial = 0
-    assert n_batches_with_extra_trial < n_batches
-    all_inds = np.array(range(n_trials))
+    all_inds = np.arange(n_trials)
     if shuffle:
         rng.shuffle(all_inds)
-    i_start_trial = 0
-    i_stop_trial = 0
-    batches = []
+    batches = _iterate_balanced_batches(all_inds, n_batches)
+    if lazy:
+        return batches
+    return list(batches)
+
+
+def _iterate_balanced_batches(all_inds, n_batches):
+    # the first n_trials % n_batches batches hold one additional trial
+    min_batch_size, n_batches_with_extra_trial = divmod(
+        len(all_inds), n_batches)
     for i_batch in range(n_batches):
-        i_stop_trial += min_batch_size
-        if i_batch < n_batches_with_extra_trial:
-            i_stop_trial += 1
-        batch_inds = all_inds[range(i_start_trial, i_stop_trial)]
-        batches.append(batch_inds)
-        i_start_trial = i_stop_trial
-    assert i_start_trial == n_trials
-    return batches
+        i_start_trial = (i_batch * min_batch_size +
+                         min(i_batch, n_batches_with_extra_trial))
+        i_stop_trial = i_start_trial + min_batch_size + int(
+            i_batch < n_batches_with_extra_trial)
+        yield all_inds[i_start_trial:i_stop_trial]
 
 
 def round_list_to_int(a):
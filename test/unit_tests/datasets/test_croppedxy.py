@@ -5,7 +5,9 @@
 # License: BSD-3
 
 import numpy as np
-from braindecode.datasets.croppedxy import CroppedXyDataset
+from braindecode.datasets.croppedxy import (
+    CroppedXyDataset, _create_supercrop_index)
+from braindecode.datautil.windowers import _supercrop_starts
 
 
 def test_crops_data_loader_explicit():
@@ -30,3 +32,35 @@ def test_crops_data_loader_explicit():
 
     for actual, expected,  in zip(Xs, expected_crops):
         np.testing.assert_array_equal(actual.squeeze(), expected)
+
+
+def test_crops_getitems():
+    rng = np.random.RandomState(42)
+    X = rng.randn(3, 2, 15)
+    y = [0, 1, 2]
+    dataset = CroppedXyDataset(X, y, input_time_length=10,
+                               n_preds_per_input=4)
+    indices = [8, 0, 4]
+    batch = dataset.__getitems__(indices)
+    assert batch.X.shape == (3, 2, 10)
+    for i, (x, y, inds) in zip(indices, batch):
+        expected_x, expected_y, expected_inds = dataset[i]
+        np.testing.assert_array_equal(x, expected_x)
+        assert y == expected_y
+        assert tuple(inds) == expected_inds
+    list_dataset = CroppedXyDataset(
+        list(X), [0, 1, 2], input_time_length=10, n_preds_per_input=4)
+    np.testing.assert_array_equal(
+        list_dataset.__getitems__(indices).X, batch.X)
+
+
+def test_supercrop_index_of_trials_with_different_lengths():
+    trial_lengths = np.array([15, 9, 22, 15, 10])
+    index = _create_supercrop_index(trial_lengths, 10, 4)
+    expected = []
+    for i_trial, trial_length in enumerate(trial_lengths):
+        _, i_supercrop_in_trials, starts, stops = _supercrop_starts(
+            np.array([0]), 0, trial_length, 10, 4, drop_samples=False)
+        expected.extend(zip([i_trial] * len(starts), i_supercrop_in_trials,
+                            starts, stops))
+    assert index.tolist() == expected
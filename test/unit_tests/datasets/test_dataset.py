@@ -3,12 +3,22 @@
 #
 # License: BSD (3-clause)
 
+import gc
+import pickle
+import weakref
+
 import mne
 import numpy as np
 import pandas as pd
 import pytest
+from torch.utils.data import DataLoader
 
-from braindecode.datasets import WindowsDataset, BaseDataset
+from braindecode.datasets import (
+    WindowsDataset, BaseDataset, BaseConcatDataset, MOABBDataset)
+from braindecode.datasets.base import collate_windows_batch
+from braindecode.datasets import datasets
+from braindecode.datasets.datasets import _create_windows_ds, _map_recordings
+from braindecode.datautil.windowers import ArrayWindows, FixedLengthWindower
 
 
 @pytest.fixture(scope="module")
@@ -63,3 +73,323 @@ def test_target_in_subject_info(set_up):
                       columns=["pathological", "gender", "age"])
     with pytest.raises(AssertionError, match="'does_not_exist' not in info"):
         BaseDataset(raw, df, target='does_not_exist')
+
+
+def test_get_item_array_windows(set_up):
+    epochs_data, windows_dataset, events, supercrop_idxs, raw = set_up
+    size = 100
+    windows = ArrayWindows(
+        [raw.get_data()], [(0, start, start + size) for start in events[:, 0]],
+        events, windows_dataset.windows.metadata)
+    array_windows_dataset = WindowsDataset(windows, windows.metadata)
+    assert len(array_windows_dataset) == len(windows_dataset)
+    for i in range(len(epochs_data)):
+        x, y, inds = array_windows_dataset[i]
+        start = events[i, 0]
+        np.testing.assert_allclose(raw.get_data()[:, start:start + size], x)
+        assert events[i, 2] == y, f'Y not equal for epoch {i}'
+        np.testing.assert_array_equal(supercrop_idxs[i], inds,
+                                      f'Supercrop inds not equal for epoch {i}')
+
+
+def test_window_columns(set_up):
+    _, windows_dataset, events, supercrop_idxs, raw = set_up
+    metadata = windows_dataset.windows.metadata
+    windows = ArrayWindows(
+        [raw.get_data()], [(0, start, start + 36) for start in events[:, 0]],
+        events, metadata)
+    assert all(column.flags['C_CONTIGUOUS']
+               for column in windows.columns.values())
+    pd.testing.assert_frame_equal(windows.metadata, metadata)
+
+    # windows dropped by mne.Epochs after a first access are not returned
+    events = np.concatenate([events, [[990, 0, 5]]])
+    metadata = pd.concat([metadata, metadata.iloc[[0]]], ignore_index=True)
+    epochs = mne.Epochs(raw=raw, events=events, metadata=metadata)
+    ds = WindowsDataset(epochs, metadata)
+    assert ds[0][1] == events[0, 2]
+    epochs.drop_bad()
+    assert len(ds) == 5
+    assert ds[4][1] == events[4, 2]
+    assert len(ds.__getitems__([0, 4]).y) == 2
+    assert ds[4][2] == list(supercrop_idxs[4])
+
+
+def test_split(set_up):
+    _, windows_dataset, _, _, raw = set_up
+    windower = FixedLengthWindower(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        supercrop_size_samples=100, supercrop_stride_samples=100,
+        use_mne_epochs=False)
+    info = pd.DataFrame(zip(["a", "b", "a"], [0, 1, 0]),
+                        columns=["session", "age"])
+    concat_ds = BaseConcatDataset(
+        [windows_dataset] + [
+            WindowsDataset(windower(BaseDataset(raw, info.iloc[[i]], "age")),
+                           info.iloc[[i]]) for i in range(1, 3)], info)
+    assert len(concat_ds) == 25
+    np.testing.assert_allclose(concat_ds[-1][0], concat_ds[24][0])
+    splits = concat_ds.split("session")
+    np.testing.assert_array_equal(
+        splits["a"].indices, list(range(5)) + list(range(15, 25)))
+    np.testing.assert_array_equal(splits["b"].indices, range(5, 15))
+    # info indexed by labels instead of positions, e.g. after a query
+    concat_ds.info.index = [7, 3, 5]
+    splits = concat_ds.split("session")
+    np.testing.assert_array_equal(splits["b"].indices, range(5, 15))
+    splits = concat_ds.split(split_ids=[[2, 1], []])
+    np.testing.assert_array_equal(
+        splits[0].indices, list(range(15, 25)) + list(range(5, 15)))
+    assert len(splits[1]) == 0
+    batch = splits[0].__getitems__([12, 0, 3])
+    for i, (x, y, inds) in zip([7, 15, 18], batch):
+        expected_x, expected_y, expected_inds = concat_ds[i]
+        np.testing.assert_allclose(x, expected_x)
+        assert y == expected_y
+        assert inds == expected_inds
+
+
+def test_rewindow(set_up):
+    _, _, _, _, raw = set_up
+    info = pd.DataFrame(zip([48, 52]), columns=["age"])
+    windower_kwargs = dict(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        use_mne_epochs=False)
+    concat_ds = BaseConcatDataset(_map_recordings(
+        _create_windows_ds,
+        [(raw.copy(), info.iloc[[i]], FixedLengthWindower(
+            supercrop_size_samples=100, supercrop_stride_samples=100,
+            **windower_kwargs), "age") for i in range(2)],
+        names=["first", "second"], n_jobs=1), info)
+    rewindowed_ds = concat_ds.rewindow(FixedLengthWindower(
+        supercrop_size_samples=200, supercrop_stride_samples=50,
+        **windower_kwargs))
+    assert len(concat_ds) == 20
+    assert len(rewindowed_ds) == 34
+    pd.testing.assert_frame_equal(rewindowed_ds.info, concat_ds.info)
+    for ds, rewindowed in zip(concat_ds.datasets, rewindowed_ds.datasets):
+        assert rewindowed.windows.data[0] is ds.windows.data[0]
+    x, y, inds = rewindowed_ds[18]
+    np.testing.assert_array_equal(x, raw.get_data()[:, 50:250])
+    assert y == 52
+    assert inds == [1, 50, 250]
+
+
+def test_rewindow_loaded(set_up, tmpdir):
+    _, _, _, _, raw = set_up
+    info = pd.DataFrame(zip([48]), columns=["age"])
+    windower = FixedLengthWindower(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        supercrop_size_samples=100, supercrop_stride_samples=100,
+        use_mne_epochs=False)
+    BaseConcatDataset(
+        [_create_windows_ds(raw.copy(), info, windower, target="age")],
+        info).save(str(tmpdir))
+    loaded_ds = BaseConcatDataset.load(str(tmpdir))
+    with pytest.raises(AssertionError, match="loaded datasets"):
+        loaded_ds.rewindow(windower)
+
+
+def test_storage_dtype_releases_preloaded_raw(set_up):
+    _, _, _, _, raw = set_up
+    raw = raw.copy()
+    raw_data = weakref.ref(raw._data)
+    ds = _create_windows_ds(
+        raw, pd.DataFrame(zip([48]), columns=["age"]),
+        FixedLengthWindower(
+            trial_start_offset_samples=0, trial_stop_offset_samples=0,
+            supercrop_size_samples=100, supercrop_stride_samples=100,
+            use_mne_epochs=False, dtype="float16"), target="age")
+    del raw
+    gc.collect()
+    assert raw_data() is None
+    assert ds.base_ds is None
+    x, y, inds = ds[3]
+    assert x.dtype == ds.__getitems__([3]).X.dtype == np.float32
+    with pytest.raises(AssertionError, match="storage dtype"):
+        BaseConcatDataset([ds]).rewindow(FixedLengthWindower(
+            trial_start_offset_samples=0, trial_stop_offset_samples=0,
+            supercrop_size_samples=200, supercrop_stride_samples=200,
+            use_mne_epochs=False))
+
+
+def test_save_load(set_up, tmpdir):
+    epochs_data, windows_dataset, events, supercrop_idxs, raw = set_up
+    windower = FixedLengthWindower(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        supercrop_size_samples=100, supercrop_stride_samples=100,
+        use_mne_epochs=False)
+    info = pd.DataFrame(zip([True, False], ["M", "F"], [48, 52]),
+                        columns=["pathological", "gender", "age"])
+    array_windows_dataset = WindowsDataset(
+        windower(BaseDataset(raw, info.iloc[[1]], target="age")),
+        info.iloc[[1]])
+    concat_ds = BaseConcatDataset(
+        [windows_dataset, array_windows_dataset], info)
+    concat_ds.save(str(tmpdir))
+
+    for mmap in [True, False]:
+        loaded_ds = BaseConcatDataset.load(str(tmpdir), mmap=mmap)
+        assert len(loaded_ds) == len(concat_ds)
+        pd.testing.assert_frame_equal(loaded_ds.info, concat_ds.info)
+        for i in range(len(concat_ds)):
+            x, y, inds = concat_ds[i]
+            loaded_x, loaded_y, loaded_inds = loaded_ds[i]
+            np.testing.assert_allclose(x, loaded_x)
+            assert y == loaded_y
+            np.testing.assert_array_equal(inds, loaded_inds)
+    loaded_ds = BaseConcatDataset.load(str(tmpdir), mmap=True)
+    assert [len(ds.windows.data) for ds in loaded_ds.datasets] == [1, 1]
+    unpickled_ds = pickle.loads(pickle.dumps(loaded_ds))
+    signals = [ds.windows.data[0] for ds in unpickled_ds.datasets]
+    assert all(isinstance(signal, np.memmap) for signal in signals)
+    # both signals are views of one file opened once
+    assert signals[0].base is signals[1].base
+
+
+def test_save_load_info(set_up, tmpdir):
+    _, windows_dataset, _, _, _ = set_up
+    info = pd.DataFrame({
+        "subject": ["007", "003"], "age": [48, 52],
+        "pathological": [True, False], "date": ["2013-01-01", "2014-02-03"],
+        "score": [0.5, np.nan]}, index=[7, 3])
+    BaseConcatDataset([windows_dataset] * 2, info).save(str(tmpdir))
+    loaded_ds = BaseConcatDataset.load(str(tmpdir))
+    pd.testing.assert_frame_equal(loaded_ds.info, info)
+    pd.testing.assert_frame_equal(loaded_ds.datasets[1].info, info.iloc[[1]])
+
+    BaseConcatDataset([windows_dataset] * 2).save(str(tmpdir))
+    loaded_ds = BaseConcatDataset.load(str(tmpdir))
+    assert loaded_ds.info is None
+    assert loaded_ds.datasets[0].info is None
+    assert len(loaded_ds) == 2 * len(windows_dataset)
+
+
+def test_save_load_many_recordings(tmpdir):
+    # every recording in its own file would exceed the limit of open files
+    rng = np.random.RandomState(0)
+    datasets = []
+    for i_recording in range(300):
+        windows = ArrayWindows(
+            [rng.randn(2, 20).astype(np.float32)], [(0, 0, 10), (0, 10, 20)],
+            np.array([[0, 0, i_recording], [10, 0, i_recording]]),
+            pd.DataFrame({"i_supercrop_in_trial": [0, 1],
+                          "i_start_in_trial": [0, 10],
+                          "i_stop_in_trial": [10, 20]}))
+        datasets.append(WindowsDataset(windows, windows.metadata))
+    concat_ds = BaseConcatDataset(
+        datasets, pd.DataFrame({"i_recording": range(300)}))
+    concat_ds.save(str(tmpdir))
+    loaded_ds = BaseConcatDataset.load(str(tmpdir), mmap=True)
+    unpickled_ds = pickle.loads(pickle.dumps(loaded_ds))
+    roots = set(id(ds.windows.data[0].base) for ds in unpickled_ds.datasets)
+    assert len(roots) == 1
+    indices = np.arange(len(concat_ds))
+    np.testing.assert_array_equal(
+        unpickled_ds.__getitems__(indices).X,
+        concat_ds.__getitems__(indices).X)
+
+
+def test_getitems(set_up):
+    epochs_data, windows_dataset, events, supercrop_idxs, raw = set_up
+    windows = ArrayWindows(
+        [raw.get_data()], [(0, start, start + 36) for start in events[:, 0]],
+        events, windows_dataset.windows.metadata)
+    concat_ds = BaseConcatDataset(
+        [windows_dataset, WindowsDataset(windows, windows.metadata)])
+    indices = [7, 0, 9, 3, 3, 5, -1]
+    batch = concat_ds.__getitems__(indices)
+    assert batch.X.shape == (len(indices), 2, 36)
+    for i, (x, y, inds) in zip(indices, batch):
+        expected_x, expected_y, expected_inds = concat_ds[i]
+        np.testing.assert_allclose(x, expected_x)
+        assert y == expected_y
+        assert inds == expected_inds
+
+    for collate_fn in [None, collate_windows_batch]:
+        loader = DataLoader(concat_ds, batch_size=4, collate_fn=collate_fn)
+        X, y, inds = next(iter(loader))
+        np.testing.assert_allclose(X.numpy(), epochs_data[:4])
+        np.testing.assert_array_equal(y.numpy(), events[:4, 2])
+        assert len(inds) == 3
+        np.testing.assert_array_equal(
+            np.stack([i.numpy() for i in inds], axis=1), supercrop_idxs[:4])
+
+
+def test_save_load_quantized(set_up, tmpdir):
+    _, _, _, _, raw = set_up
+    info = pd.DataFrame(zip([48]), columns=["age"])
+    concat_ds = BaseConcatDataset([_create_windows_ds(
+        raw, info, FixedLengthWindower(
+            trial_start_offset_samples=0, trial_stop_offset_samples=0,
+            supercrop_size_samples=100, supercrop_stride_samples=100,
+            use_mne_epochs=False, dtype="int16"), target="age")], info)
+    concat_ds.save(str(tmpdir))
+    loaded_ds = BaseConcatDataset.load(str(tmpdir), mmap=True)
+    signal = loaded_ds.datasets[0].windows.data[0]
+    assert isinstance(signal.data, np.memmap)
+    assert signal.data.dtype == np.int16
+    unpickled_ds = pickle.loads(pickle.dumps(loaded_ds))
+    assert isinstance(unpickled_ds.datasets[0].windows.data[0].data,
+                      np.memmap)
+    indices = np.arange(len(concat_ds))
+    np.testing.assert_array_equal(
+        unpickled_ds.__getitems__(indices).X,
+        concat_ds.__getitems__(indices).X)
+
+
+def _window_or_fail(raw, info, windower):
+    if info["age"].iloc[0] < 0:
+        raise ValueError("invalid age")
+    return _create_windows_ds(raw, info, windower, target="age")
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_map_recordings(set_up, n_jobs):
+    _, _, _, _, raw = set_up
+    windower = FixedLengthWindower(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        supercrop_size_samples=100, supercrop_stride_samples=100)
+    info = pd.DataFrame(zip([48, 52, -1]), columns=["age"])
+    all_windows_ds = _map_recordings(
+        _window_or_fail, [(raw, info.iloc[[i]], windower) for i in range(2)],
+        names=["first", "second"], n_jobs=n_jobs)
+    assert [ds.info["age"].iloc[0] for ds in all_windows_ds] == [48, 52]
+    with pytest.raises(ValueError, match=r"invalid age \(while processing "
+                                         r"third\)"):
+        _map_recordings(
+            _window_or_fail,
+            [(raw, info.iloc[[i]], windower) for i in range(3)],
+            names=["first", "second", "third"], n_jobs=n_jobs)
+
+
+def _fetch_fake_moabb_data(dataset_name, subject_ids):
+    assert isinstance(subject_ids, int)
+    info = mne.create_info(ch_names=['0', '1', 'stim'], sfreq=50,
+                           ch_types=['eeg', 'eeg', 'stim'])
+    raws = []
+    for i_run in range(2):
+        data = np.full((3, 500), subject_ids, dtype=float)
+        data[2] = 0
+        data[2, [50, 200, 350][:2 + i_run]] = [1, 2, 1][:2 + i_run]
+        raws.append(mne.io.RawArray(data, info, verbose="error"))
+    return raws, pd.DataFrame(
+        zip([subject_ids] * 2, ["session_T"] * 2, ["run_0", "run_1"]),
+        columns=["subject", "session", "run"])
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_moabb_dataset_fetches_subjects_in_workers(monkeypatch, n_jobs):
+    monkeypatch.setattr(
+        datasets, "fetch_data_with_moabb", _fetch_fake_moabb_data)
+    ds = MOABBDataset(
+        "fake", [3, 1], trial_start_offset_samples=0,
+        trial_stop_offset_samples=100, supercrop_size_samples=100,
+        supercrop_stride_samples=100, use_mne_epochs=False, n_jobs=n_jobs)
+    pd.testing.assert_frame_equal(ds.info, pd.concat(
+        [_fetch_fake_moabb_data("fake", subject)[1] for subject in [3, 1]],
+        ignore_index=True))
+    assert [len(windows_ds) for windows_ds in ds.datasets] == [2, 3, 2, 3]
+    assert [windows_ds[0][0][0, 0] for windows_ds in ds.datasets] == [
+        3, 3, 1, 1]
+    assert [windows_ds[1][1] for windows_ds in ds.datasets] == [2] * 4
@@ -0,0 +1,183 @@
+# Authors: Lukas Gemein <l.gemein@gmail.com>
+#
+# License: BSD-3
+
+import os
+import glob
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import mne
+import numpy as np
+import pandas as pd
+import pytest
+
+from braindecode.datasets import TUHAbnormal, BaseConcatDataset
+from braindecode.datasets.datasets import read_all_file_names
+from braindecode.datasets.edf import read_edf_header, read_edf_headers
+
+
+def _write_edf(file_path, data, sfreq, patient_id):
+    """Write int16 data of shape (n_channels, n_times) in records of 1 s."""
+    def field(value, width):
+        return str(value).ljust(width)[:width]
+
+    n_channels, n_times = data.shape
+    n_samples_per_record = int(sfreq)
+    n_records = n_times // n_samples_per_record
+    header = (field(0, 8) + field(patient_id, 80) + field("Startdate", 80) +
+              field("01.01.13", 8) + field("00.00.00", 8) +
+              field(256 * (n_channels + 1), 8) + field("", 44) +
+              field(n_records, 8) + field(1, 8) + field(n_channels, 4))
+    for width, value in [(16, None), (80, ""), (8, "uV"), (8, -32768),
+                         (8, 32767), (8, -32768), (8, 32767), (80, ""),
+                         (8, n_samples_per_record), (32, "")]:
+        for i_channel in range(n_channels):
+            header += field(
+                f"EEG {i_channel}" if value is None else value, width)
+    records = data[:, :n_records * n_samples_per_record].reshape(
+        n_channels, n_records, n_samples_per_record).transpose(1, 0, 2)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(records.astype("<i2").tobytes())
+
+
+@pytest.fixture(scope="module")
+def tuh_path(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp("tuh"))
+    rng = np.random.RandomState(42)
+    for i_file, (pathology, age, gender) in enumerate(
+            [("normal", 48, "M"), ("abnormal", 71, "F"), ("normal", 30, "F")]):
+        file_path = os.path.join(
+            path, "train", pathology, "01_tcp_ar", f"00{i_file}",
+            f"0000000{i_file}", f"s00{i_file}_2013_01_0{i_file + 1}",
+            f"0000000{i_file}_s00{i_file}_t000.edf")
+        data = rng.randint(-1000, 1000, size=(3, 1000 + 100 * i_file))
+        _write_edf(file_path, data, 100,
+                   f"0000000{i_file} {gender} 01-JAN-1900 Age:{age}")
+    return path + "/"
+
+
+def test_read_edf_header(tuh_path):
+    [file_path] = glob.glob(tuh_path + "**/00000001_s001_t000.edf",
+                            recursive=True)
+    raw = mne.io.read_raw_edf(file_path)
+    header = read_edf_header(file_path)
+    assert header["n_times"] == raw.n_times
+    assert header["sfreq"] == raw.info["sfreq"]
+    assert header["ch_names"] == raw.ch_names
+
+
+def test_lazy_tuh_abnormal(tuh_path):
+    kwargs = dict(trial_start_offset_samples=0, trial_stop_offset_samples=0,
+                  supercrop_size_samples=200, supercrop_stride_samples=150,
+                  mapping={True: 1, False: 0}, use_mne_epochs=False)
+    ds = TUHAbnormal(tuh_path, **kwargs)
+    lazy_ds = TUHAbnormal(tuh_path, lazy=True, max_open_files=2, **kwargs)
+    cache = lazy_ds.datasets[0].windows.data[0].cache
+    assert len(cache) == 0
+    assert len(lazy_ds) == len(ds)
+    assert lazy_ds.info.equals(ds.info)
+    for i in range(len(ds)):
+        x, y, inds = ds[i]
+        lazy_x, lazy_y, lazy_inds = lazy_ds[i]
+        np.testing.assert_allclose(x, lazy_x)
+        assert y == lazy_y
+        np.testing.assert_array_equal(inds, lazy_inds)
+        assert len(cache) <= 2
+    assert len(cache) == 2
+    unpickled_ds = pickle.loads(pickle.dumps(lazy_ds))
+    assert len(unpickled_ds.datasets[0].windows.data[0].cache) == 0
+    np.testing.assert_allclose(unpickled_ds[0][0], ds[0][0])
+
+
+def test_lazy_tuh_abnormal_threads(tuh_path):
+    kwargs = dict(trial_start_offset_samples=0, trial_stop_offset_samples=0,
+                  supercrop_size_samples=200, supercrop_stride_samples=150,
+                  mapping={True: 1, False: 0}, use_mne_epochs=False)
+    ds = TUHAbnormal(tuh_path, **kwargs)
+    lazy_ds = TUHAbnormal(tuh_path, lazy=True, max_open_files=1, **kwargs)
+    indices = np.tile(np.arange(len(ds)), 20)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        lazy_X = list(executor.map(lambda i: lazy_ds[i][0], indices))
+    for i, lazy_x in zip(indices, lazy_X):
+        np.testing.assert_allclose(lazy_x, ds[i][0])
+    assert len(lazy_ds.datasets[0].windows.data[0].cache) == 1
+
+
+def test_save_load_lazy_tuh_abnormal(tuh_path, tmpdir):
+    kwargs = dict(trial_start_offset_samples=0, trial_stop_offset_samples=0,
+                  supercrop_size_samples=200, supercrop_stride_samples=150,
+                  mapping={True: 1, False: 0}, use_mne_epochs=False)
+    ds = TUHAbnormal(tuh_path, **kwargs)
+    TUHAbnormal(tuh_path, lazy=True, **kwargs).save(str(tmpdir))
+    loaded_ds = BaseConcatDataset.load(str(tmpdir))
+    assert len(loaded_ds) == len(ds)
+    indices = np.arange(len(ds))
+    np.testing.assert_allclose(loaded_ds.__getitems__(indices).X,
+                               ds.__getitems__(indices).X)
+
+
+def test_read_all_file_names_with_manifest(tuh_path, tmpdir, monkeypatch):
+    ds = TUHAbnormal(tuh_path, 0, 0, 100, 100, mapping={True: 1, False: 0})
+    key = ds._time_key
+    expected = sorted(
+        glob.glob(tuh_path + "**/*.edf", recursive=True), key=key)
+    manifest_path = str(tmpdir.join("manifest.json"))
+    file_paths = read_all_file_names(
+        tuh_path, ".edf", key, manifest_path=manifest_path, n_jobs=2)
+    assert file_paths == expected
+
+    scanned_paths = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scanned_paths.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    file_paths = read_all_file_names(
+        tuh_path, ".edf", key, manifest_path=manifest_path)
+    assert file_paths == expected
+    assert scanned_paths == []
+
+    new_dir = os.path.dirname(expected[0])
+    new_file_path = os.path.join(new_dir, "00000000_s000_t001.edf")
+    open(new_file_path, "wb").close()
+    try:
+        file_paths = read_all_file_names(
+            tuh_path, ".edf", key, manifest_path=manifest_path)
+    finally:
+        os.remove(new_file_path)
+    assert file_paths == [expected[0], new_file_path] + expected[1:]
+    assert scanned_paths == [new_dir]
+
+
+def test_read_edf_headers(tuh_path, tmpdir):
+    file_paths = sorted(glob.glob(tuh_path + "**/*.edf", recursive=True))
+    index_path = str(tmpdir.join("headers.json"))
+    headers = read_edf_headers(file_paths, index_path=index_path, n_jobs=2)
+    assert list(headers["path"]) == file_paths
+    for file_path, (_, row) in zip(file_paths, headers.iterrows()):
+        header = read_edf_header(file_path)
+        assert row["n_times"] == header["n_times"]
+        assert row["ch_names"] == header["ch_names"]
+        assert row["duration"] == header["n_times"] / header["sfreq"]
+    reloaded_headers = read_edf_headers(
+        file_paths[::-1], index_path=index_path)
+    pd.testing.assert_frame_equal(
+        reloaded_headers, headers[::-1].reset_index(drop=True))
+
+
+def test_tuh_abnormal_query(tuh_path):
+    ds = TUHAbnormal(tuh_path, 0, 0, 100, 100, mapping={True: 1, False: 0},
+                     query="age > 40")
+    assert list(ds.info["age"]) == [48, 71]
+    assert list(ds.info["subject"]) == [0, 1]
+    ds = TUHAbnormal(tuh_path, 0, 0, 100, 100, mapping={True: 1, False: 0},
+                     query="gender == 'F' and duration > 11", lazy=True)
+    assert list(ds.info["age"]) == [30]
+    assert list(ds.info["subject"]) == [2]
+    assert len(ds) == 12
+    assert len(ds.split("pathological")[False]) == 12
@@ -0,0 +1,149 @@
+# License: BSD-3
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from braindecode.datasets import WindowsDataset, BaseConcatDataset
+from braindecode.datautil.iterators import (
+    CropsFromTrialsIterator, WindowsIterator, PrefetchIterator,
+    BatchBufferPool, _compute_start_stop_block_inds,
+    _create_batch_from_i_trial_start_stop_blocks)
+from braindecode.datautil.windowers import ArrayWindows
+
+
+def _start_stop_blocks_in_loop(i_trial_start, i_trial_stop,
+                               input_time_length, n_preds_per_input):
+    start_stop_blocks = []
+    i_window_stop = i_trial_start
+    while i_window_stop < i_trial_stop:
+        i_window_stop += n_preds_per_input
+        i_adjusted_stop = min(i_window_stop, i_trial_stop)
+        start_stop_blocks.append(
+            (i_adjusted_stop - input_time_length, i_adjusted_stop))
+    return start_stop_blocks
+
+
+def test_compute_start_stop_block_inds():
+    i_trial_starts = [9, 9, 9, 0, 5]
+    i_trial_stops = [100, 21, 19, 30, 5]
+    blocks = _compute_start_stop_block_inds(
+        i_trial_starts, i_trial_stops, input_time_length=20,
+        n_preds_per_input=11, check_preds_smaller_trial_len=False)
+    assert blocks == [
+        _start_stop_blocks_in_loop(start, stop, 20, 11)
+        for start, stop in zip(i_trial_starts, i_trial_stops)]
+    with pytest.raises(AssertionError, match="n_preds_per_input"):
+        _compute_start_stop_block_inds(
+            i_trial_starts, i_trial_stops, input_time_length=20,
+            n_preds_per_input=11, check_preds_smaller_trial_len=True)
+
+
+def test_crops_from_trials_iterator():
+    rng = np.random.RandomState(42)
+
+    class Dataset(object):
+        X = [rng.randn(2, n_times) for n_times in [50, 37, 50]]
+        y = np.array([0, 1, 2])
+
+    iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=20, n_preds_per_input=8)
+    batches = list(iterator.get_batches(Dataset, shuffle=False))
+    X = np.concatenate([batch_X for batch_X, _ in batches])
+    y = np.concatenate([batch_y for _, batch_y in batches])
+    expected = [
+        (i_trial, start, stop)
+        for i_trial, trial in enumerate(Dataset.X)
+        for start, stop in _start_stop_blocks_in_loop(
+            12, trial.shape[1], 20, 8)]
+    assert len(X) == len(expected)
+    for x, target, (i_trial, start, stop) in zip(X, y, expected):
+        np.testing.assert_array_equal(
+            x[:, :, 0], Dataset.X[i_trial][:, start:stop])
+        assert target == Dataset.y[i_trial]
+
+
+@pytest.mark.parametrize("as_array", [False, True])
+def test_crops_from_trials_iterator_reuses_buffers(as_array):
+    rng = np.random.RandomState(42)
+
+    class Dataset(object):
+        X = rng.randn(5, 2, 50).astype(np.float32)
+        y = np.arange(5)
+
+    if not as_array:
+        Dataset.X = list(Dataset.X)
+    iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=20, n_preds_per_input=8)
+    expected = list(iterator.get_batches(Dataset, shuffle=False))
+    iterator.reset_rng()
+    batch_buffers = []
+    for (batch_X, batch_y), (expected_X, expected_y) in zip(
+            iterator.get_batches(Dataset, shuffle=False), expected):
+        assert batch_X.dtype == np.float32
+        np.testing.assert_array_equal(batch_X, expected_X)
+        np.testing.assert_array_equal(batch_y, expected_y)
+        batch_buffers.append(batch_X)
+        iterator.release((batch_X, batch_y))
+    # batches of the same shape are filled into the same buffer
+    assert len(batch_buffers) > 2
+    assert (len({id(batch_X) for batch_X in batch_buffers}) ==
+            len({batch_X.shape for batch_X in batch_buffers}))
+
+
+def test_create_batch_from_blocks_out_of_trial():
+    X = np.zeros((2, 3, 100), dtype=np.float32)
+    with pytest.raises(ValueError):
+        _create_batch_from_i_trial_start_stop_blocks(X, [0, 1], [(1, 50, 110)])
+
+
+def test_batch_buffer_pool_shared_between_threads():
+    pool = BatchBufferPool()
+
+    def fill(value):
+        for _ in range(200):
+            buffer = pool.get((4, 3), np.float32)
+            buffer[:] = value
+            # no other thread got the same buffer in the meantime
+            assert (buffer == value).all()
+            pool.release(buffer)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(fill, range(8)))
+
+
+class _TrialDataset(object):
+    X = np.random.RandomState(42).randn(6, 2, 50)
+    y = np.arange(6)
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_prefetch_iterator(use_processes):
+    signal = np.random.RandomState(42).randn(2, 300)
+    starts = np.arange(0, 280, 10)
+    windows = ArrayWindows(
+        [signal], [(0, start, start + 20) for start in starts],
+        np.stack([starts, np.full(len(starts), 20), starts % 3], axis=1),
+        pd.DataFrame({"i_supercrop_in_trial": np.arange(len(starts)),
+                      "i_start_in_trial": starts,
+                      "i_stop_in_trial": starts + 20}))
+    windows_dataset = BaseConcatDataset(
+        [WindowsDataset(windows, None)] * 2)
+
+    for make_iterator, dataset in [
+            (lambda: CropsFromTrialsIterator(
+                batch_size=4, input_time_length=20, n_preds_per_input=8),
+             _TrialDataset),
+            (lambda: WindowsIterator(batch_size=5), windows_dataset)]:
+        expected = list(make_iterator().get_batches(dataset, shuffle=True))
+        iterator = PrefetchIterator(
+            make_iterator(), n_prefetch=3, n_jobs=2,
+            use_processes=use_processes)
+        batches = list(iterator.get_batches(dataset, shuffle=True))
+        assert len(batches) == len(expected) > 3
+        for batch, expected_batch in zip(batches, expected):
+            assert len(batch) == len(expected_batch)
+            for array, expected_array in zip(batch, expected_batch):
+                np.testing.assert_array_equal(array, expected_array)
@@ -0,0 +1,89 @@
+# License: BSD-3
+
+import numpy as np
+import pandas as pd
+from torch.utils.data import ConcatDataset
+
+from braindecode.datasets import BaseConcatDataset, WindowsDataset
+from braindecode.datautil.samplers import RecordingSampler
+from braindecode.datautil.windowers import ArrayWindows
+
+
+def _concat_dataset(sizes):
+    return ConcatDataset([np.zeros(size) for size in sizes])
+
+
+def test_recording_sampler_locality():
+    sizes = [30, 10, 50, 20, 40, 25, 35, 15]
+    dataset = _concat_dataset(sizes)
+    i_recordings = np.repeat(np.arange(len(sizes)), sizes)
+    sampler = RecordingSampler(dataset, n_open_recordings=2, seed=1)
+    window_ids = list(sampler)
+    assert len(sampler) == len(window_ids) == len(dataset)
+    assert sorted(window_ids) == list(range(len(dataset)))
+    # windows of a recording are only interleaved with windows of few others
+    recordings_of_windows = i_recordings[window_ids]
+    first = {i: np.flatnonzero(recordings_of_windows == i)[0]
+             for i in range(len(sizes))}
+    last = {i: np.flatnonzero(recordings_of_windows == i)[-1]
+            for i in range(len(sizes))}
+    for i_window in range(len(window_ids)):
+        n_open = sum(first[i] <= i_window <= last[i]
+                     for i in range(len(sizes)))
+        assert n_open <= 3
+    assert list(sampler) == window_ids
+    sampler.set_epoch(1)
+    assert list(sampler) != window_ids
+
+    sampler = RecordingSampler(dataset, n_open_recordings=1, shuffle=False)
+    assert list(sampler) == list(range(len(dataset)))
+
+
+def test_recording_sampler_replicas():
+    sizes = [30, 10, 50, 20, 40]
+    dataset = _concat_dataset(sizes)
+    i_recordings = np.repeat(np.arange(len(sizes)), sizes)
+    samplers = [RecordingSampler(dataset, seed=3, num_replicas=2, rank=rank)
+                for rank in range(2)]
+    window_ids = [list(sampler) for sampler in samplers]
+    assert len(window_ids[0]) == len(window_ids[1]) == len(samplers[0])
+    recordings = [set(i_recordings[ids]) for ids in window_ids]
+    assert recordings[0].isdisjoint(recordings[1])
+    assert recordings[0] | recordings[1] == set(range(len(sizes)))
+    assert set(window_ids[0]) | set(window_ids[1]) == set(
+        range(len(dataset)))
+
+
+def _windows_dataset(size):
+    starts = np.arange(size)
+    windows = ArrayWindows(
+        [np.zeros((2, size + 10))],
+        [(0, start, start + 10) for start in starts],
+        np.stack([starts, np.full(size, 10), np.zeros(size)], axis=1),
+        pd.DataFrame({"i_supercrop_in_trial": starts,
+                      "i_start_in_trial": starts,
+                      "i_stop_in_trial": starts + 10}))
+    return WindowsDataset(windows, None)
+
+
+def test_recording_sampler_on_split():
+    sizes = [30, 10, 50, 20, 40]
+    info = pd.DataFrame({"session": ["train", "test", "train", "train",
+                                     "test"]})
+    dataset = BaseConcatDataset(
+        [_windows_dataset(size) for size in sizes], info)
+    train_set = dataset.split("session")["train"]
+    assert train_set.cumulative_sizes == [30, 80, 100]
+    sampler = RecordingSampler(train_set, seed=2)
+    assert sorted(sampler) == list(range(len(train_set)))
+
+
+def test_recording_sampler_skips_recordings_without_windows():
+    sizes = [0, 30, 0, 0, 10]
+    dataset = _concat_dataset(sizes)
+    samplers = [RecordingSampler(dataset, seed=3, num_replicas=2, rank=rank)
+                for rank in range(2)]
+    window_ids = [list(sampler) for sampler in samplers]
+    assert len(window_ids[0]) == len(window_ids[1]) == 30
+    assert set(window_ids[0]) | set(window_ids[1]) == set(range(40))
+    assert {len(set(ids)) for ids in window_ids} == {10, 30}
@@ -0,0 +1,97 @@
+# License: BSD-3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from braindecode.datautil.signalproc import (
+    CausalButterworthFilter, ExponentialRunningStandardizer, bandpass_cnt,
+    exponential_running_demean, exponential_running_standardize,
+    sos_bandpass_cnt)
+
+
+def _pandas_exponential_running_standardize(data, factor_new, eps):
+    df = pd.DataFrame(data)
+    demeaned = df - df.ewm(alpha=factor_new).mean()
+    square_ewmed = (demeaned * demeaned).ewm(alpha=factor_new).mean()
+    return np.array(demeaned / np.maximum(eps, np.sqrt(np.array(
+        square_ewmed))))
+
+
+@pytest.mark.parametrize("chunk_size", [7, 10000])
+def test_exponential_running_standardize(chunk_size):
+    rng = np.random.RandomState(0)
+    data = rng.randn(1000, 3) * 10 + 5
+    expected = _pandas_exponential_running_standardize(data, 0.01, 1e-4)
+    standardized = exponential_running_standardize(
+        data, factor_new=0.01, chunk_size=chunk_size)
+    np.testing.assert_allclose(standardized, expected, rtol=1e-8, atol=1e-8)
+    expected[:100] = (data[:100] - data[:100].mean(axis=1, keepdims=True)) / (
+        data[:100].std(axis=1, keepdims=True))
+    standardized = exponential_running_standardize(
+        data, factor_new=0.01, init_block_size=100, chunk_size=chunk_size)
+    np.testing.assert_allclose(standardized, expected, rtol=1e-8, atol=1e-8)
+
+    expected = np.array(pd.DataFrame(data) - pd.DataFrame(data).ewm(
+        alpha=0.01).mean())
+    demeaned = exponential_running_demean(
+        data, factor_new=0.01, chunk_size=chunk_size)
+    np.testing.assert_allclose(demeaned, expected, rtol=1e-8, atol=1e-8)
+
+
+def test_exponential_running_standardize_inplace():
+    rng = np.random.RandomState(0)
+    data = (rng.randn(1000, 3) * 10 + 5).astype(np.float32)
+    expected = _pandas_exponential_running_standardize(data, 0.001, 1e-4)
+    standardized = exponential_running_standardize(
+        data, inplace=True, chunk_size=64)
+    assert standardized is data
+    assert standardized.dtype == np.float32
+    np.testing.assert_allclose(standardized, expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("low_cut_hz,high_cut_hz", [
+    (4, 38), (4, None), (0, 38), (None, 125)])
+def test_causal_butterworth_filter_in_chunks(low_cut_hz, high_cut_hz):
+    rng = np.random.RandomState(0)
+    data = rng.randn(1000, 3)
+    expected = bandpass_cnt(data, low_cut_hz, high_cut_hz, 250)
+    filt = CausalButterworthFilter(low_cut_hz, high_cut_hz, 250)
+    filtered = np.concatenate([filt(data[i_start:i_start + 99])
+                               for i_start in range(0, len(data), 99)])
+    np.testing.assert_array_equal(filtered, expected)
+    filt.reset()
+    np.testing.assert_array_equal(filt(data), expected)
+
+
+def test_exponential_running_standardizer_in_chunks():
+    rng = np.random.RandomState(0)
+    data = rng.randn(1000, 3) * 10 + 5
+    expected = exponential_running_standardize(
+        data, factor_new=0.01, init_block_size=150)
+    standardizer = ExponentialRunningStandardizer(
+        factor_new=0.01, init_block_size=150)
+    standardized = np.concatenate([
+        standardizer(data[i_start:i_start + 99])
+        for i_start in range(0, len(data), 99)])
+    np.testing.assert_array_equal(standardized, expected)
+    standardizer.reset()
+    np.testing.assert_array_equal(standardizer(data), expected)
+
+
+@pytest.mark.parametrize("filtfilt", [False, True])
+def test_sos_bandpass_cnt(filtfilt):
+    rng = np.random.RandomState(0)
+    data = rng.randn(1000, 5)
+    expected = bandpass_cnt(data, 4, 38, 250, filtfilt=filtfilt)
+    bandpassed = sos_bandpass_cnt(data, 4, 38, 250, filtfilt=filtfilt)
+    np.testing.assert_allclose(bandpassed, expected, rtol=1e-7, atol=1e-9)
+    np.testing.assert_array_equal(
+        sos_bandpass_cnt(data, 4, 38, 250, filtfilt=filtfilt, n_jobs=2),
+        bandpassed)
+    np.testing.assert_array_equal(
+        sos_bandpass_cnt(data.T, 4, 38, 250, axis=1, filtfilt=filtfilt,
+                         n_jobs=3), bandpassed.T)
+    np.testing.assert_allclose(
+        sos_bandpass_cnt(data, 4, None, 250), bandpass_cnt(data, 4, None, 250),
+        rtol=1e-7, atol=1e-9)
@@ -11,7 +11,10 @@ import pytest
 
 from braindecode.datasets.base import BaseDataset
 from braindecode.datasets.datasets import fetch_data_with_moabb
-from braindecode.datautil import FixedLengthWindower, EventWindower
+from braindecode.datautil import (
+    FixedLengthWindower, EventWindower, StreamingWindower)
+from braindecode.datautil.windowers import (
+    _supercrop_starts, QuantizedSignal)
 
 
 @pytest.fixture(scope="module")
@@ -171,3 +174,190 @@ def test_fixed_length_windower():
                 epochs_data[j, :],
                 err_msg=f"Epochs different for test case {i} for epoch {j}"
             )
+
+
+def _previous_fixed_length_supercrops(n_times, size, stride, drop_samples):
+    # supercrops of FixedLengthWindower before it used _supercrop_starts,
+    # after mne.Epochs rejected those exceeding the recording
+    starts = np.arange(0, n_times, stride)
+    if drop_samples:
+        starts = starts[:-1]
+    elif starts[-1] != n_times - size:
+        starts[-1] = n_times - size
+    i_supercrops = np.arange(len(starts))
+    in_bounds = starts + size <= n_times
+    return i_supercrops[in_bounds].tolist(), starts[in_bounds].tolist()
+
+
+@pytest.mark.parametrize(
+    "n_times,size,stride,drop_samples,i_supercrops,starts,changed", [
+        # unchanged
+        (60, 5, 5, False, list(range(12)), list(range(0, 60, 5)), False),
+        (62, 5, 5, False, list(range(13)), list(range(0, 60, 5)) + [57],
+         False),
+        (62, 5, 5, True, list(range(12)), list(range(0, 60, 5)), False),
+        # the last complete supercrop was dropped with drop_samples
+        (60, 5, 5, True, list(range(12)), list(range(0, 60, 5)), True),
+        # the last start was moved instead of adding a supercrop
+        (50, 5, 25, False, [0, 1, 2], [0, 25, 45], True),
+        # a duplicate last supercrop with a gap in i_supercrop_in_trial
+        (60, 20, 5, False, list(range(9)), list(range(0, 45, 5)), True),
+    ])
+def test_fixed_length_windower_geometry(
+        n_times, size, stride, drop_samples, i_supercrops, starts, changed):
+    windower = FixedLengthWindower(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        supercrop_size_samples=size, supercrop_stride_samples=stride,
+        drop_samples=drop_samples)
+    _, metadata, _ = windower.create_index(
+        n_times, pd.DataFrame({"target": [1]}), "target")
+    assert metadata["i_supercrop_in_trial"].tolist() == i_supercrops
+    assert metadata["i_start_in_trial"].tolist() == starts
+    assert metadata["i_stop_in_trial"].tolist() == [
+        start + size for start in starts]
+    previous = _previous_fixed_length_supercrops(
+        n_times, size, stride, drop_samples)
+    assert (previous != (i_supercrops, starts)) == changed
+
+
+@pytest.mark.parametrize("annotations", [
+    None, mne.Annotations([3.1, 8.99, 15], [1, 0.5, 1],
+                          ["BAD_muscle", "bad blink", "good"])])
+def test_array_windows_equal_epochs(annotations):
+    rng = np.random.RandomState(42)
+    info = mne.create_info(ch_names=['0', '1', 'STI'], sfreq=50,
+                           ch_types=['eeg', 'eeg', 'stim'])
+    data = rng.randn(3, 1000)
+    data[2] = 0
+    data[2, [100, 400, 700]] = [1, 2, 1]
+    df = pd.DataFrame(zip([True], ["M"], [48]),
+                      columns=["pathological", "gender", "age"])
+
+    windower_kwargs = dict(
+        trial_start_offset_samples=-50, trial_stop_offset_samples=150,
+        supercrop_size_samples=100, supercrop_stride_samples=50)
+    for windower_cls in [EventWindower, FixedLengthWindower]:
+        raw = mne.io.RawArray(data=data, info=info, first_samp=20)
+        if annotations is not None:
+            raw.set_annotations(annotations)
+        base_ds = BaseDataset(raw, df, target="age")
+        epochs = windower_cls(**windower_kwargs)(base_ds).drop_bad()
+        windows = windower_cls(**windower_kwargs, use_mne_epochs=False)(
+            base_ds)
+        if annotations is not None:
+            assert len(epochs.drop_log) > len(epochs.events)
+        assert len(windows) == len(epochs.events)
+        np.testing.assert_array_equal(windows.events, epochs.events)
+        np.testing.assert_array_equal(
+            windows.metadata.values, epochs.metadata.values)
+        epochs_data = epochs.get_data()
+        for i_window in range(len(windows)):
+            np.testing.assert_array_equal(
+                windows.get_window(i_window), epochs_data[i_window])
+
+
+def test_fixed_length_windower_several_targets():
+    rng = np.random.RandomState(42)
+    info = mne.create_info(ch_names=['0', '1'], sfreq=50, ch_types='eeg')
+    raw = mne.io.RawArray(data=rng.randn(2, 1000), info=info)
+    df = pd.DataFrame(zip([True], ["M"], [48]),
+                      columns=["pathological", "gender", "age"])
+    base_ds = BaseDataset(raw, df, target=["age", "pathological"])
+    windower = FixedLengthWindower(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        supercrop_size_samples=300, supercrop_stride_samples=300,
+        mapping={True: 1, False: 0}, use_mne_epochs=False)
+    windows = windower(base_ds)
+    np.testing.assert_array_equal(
+        windows.windows_ind[:, 1], [0, 300, 600, 700])
+    np.testing.assert_array_equal(windows.targets, [[48, 1]] * 4)
+    events, metadata, targets = windower.create_index(
+        raw.n_times, df, ["age", "pathological"])
+    np.testing.assert_array_equal(events, windows.events)
+    np.testing.assert_array_equal(targets, windows.targets)
+    with pytest.raises(AssertionError, match="several targets"):
+        FixedLengthWindower(0, 0, 300, 300, mapping={True: 1, False: 0})(
+            base_ds)
+
+
+@pytest.mark.parametrize("size,stride", [(100, 30), (100, 100), (50, 120)])
+def test_streaming_windower(size, stride):
+    rng = np.random.RandomState(42)
+    info = mne.create_info(ch_names=['0', '1'], sfreq=50, ch_types='eeg')
+    raw = mne.io.RawArray(data=rng.randn(2, 1000), info=info)
+    df = pd.DataFrame(zip([48]), columns=["age"])
+    windows = FixedLengthWindower(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        supercrop_size_samples=size, supercrop_stride_samples=stride,
+        drop_samples=True, use_mne_epochs=False)(
+            BaseDataset(raw, df, target="age"))
+
+    data = raw.get_data()
+    chunk_bounds = np.cumsum([0, 7, 1, 130, 250, 12, 33, 400, 167])
+    chunks = [data[:, start:stop]
+              for start, stop in zip(chunk_bounds[:-1], chunk_bounds[1:])]
+    windower = StreamingWindower(2, size, stride)
+    buffer = windower._buffer
+    n_windows = 0
+    for i_window, (x, ind) in enumerate(windower(chunks)):
+        assert x.base is buffer
+        np.testing.assert_array_equal(x, windows.get_window(i_window))
+        assert list(ind) == windows.metadata.iloc[i_window][
+            ["i_supercrop_in_trial", "i_start_in_trial",
+             "i_stop_in_trial"]].to_list()
+        n_windows += 1
+    assert n_windows == len(windows)
+
+    # push writes the whole chunk, also if the result is ignored
+    windower = StreamingWindower(2, size, stride)
+    windower.push(chunks[0])
+    supercrops, ind = zip(*[windower.push(chunk) for chunk in chunks[1:]])
+    supercrops, ind = np.concatenate(supercrops), np.concatenate(ind)
+    np.testing.assert_array_equal(
+        supercrops, windows.get_windows(np.arange(len(windows))))
+    np.testing.assert_array_equal(ind, windows.metadata[
+        ["i_supercrop_in_trial", "i_start_in_trial",
+         "i_stop_in_trial"]].to_numpy())
+
+
+@pytest.mark.parametrize("dtype,rtol", [
+    ("float32", 1e-6), ("float16", 1e-3), ("int16", 1e-4)])
+def test_windower_storage_dtype(dtype, rtol):
+    rng = np.random.RandomState(42)
+    info = mne.create_info(ch_names=['0', '1'], sfreq=50, ch_types='eeg')
+    data = rng.randn(2, 1000) * np.array([[1e-5], [3]])
+    raw = mne.io.RawArray(data=data, info=info)
+    df = pd.DataFrame(zip([48]), columns=["age"])
+    windows = FixedLengthWindower(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        supercrop_size_samples=100, supercrop_stride_samples=100,
+        use_mne_epochs=False, dtype=dtype)(BaseDataset(raw, df, target="age"))
+    assert isinstance(windows.data[0], QuantizedSignal) == (dtype == "int16")
+    assert raw._data.dtype == np.float64
+    X = windows.get_windows(np.arange(len(windows)))
+    assert X.dtype == np.float32
+    expected = data.reshape(2, 10, 100).transpose(1, 0, 2)
+    atol = rtol * np.abs(data).max(axis=1)[:, None]
+    for x, expected_x in zip(X, expected):
+        assert (np.abs(x - expected_x) <= atol).all()
+    assert windows.get_window(3).dtype == np.float32
+    np.testing.assert_allclose(windows.get_window(3), X[3], rtol=1e-6)
+
+
+def test_supercrop_starts():
+    onsets = np.array([100, 1000])
+    i_trials, i_supercrop_in_trials, starts, stops = _supercrop_starts(
+        onsets, start_offset=-10, stop_offset=40, size=20, stride=12)
+    np.testing.assert_array_equal(i_trials, [0, 0, 0, 0, 1, 1, 1, 1])
+    np.testing.assert_array_equal(i_supercrop_in_trials,
+                                  [0, 1, 2, 3, 0, 1, 2, 3])
+    np.testing.assert_array_equal(
+        starts, [90, 102, 114, 120, 990, 1002, 1014, 1020])
+    np.testing.assert_array_equal(stops, starts + 20)
+
+    i_trials, i_supercrop_in_trials, starts, stops = _supercrop_starts(
+        onsets, start_offset=-10, stop_offset=40, size=20, stride=12,
+        drop_samples=True)
+    np.testing.assert_array_equal(i_trials, [0, 0, 0, 1, 1, 1])
+    np.testing.assert_array_equal(i_supercrop_in_trials, [0, 1, 2, 0, 1, 2])
+    np.testing.assert_array_equal(starts, [90, 102, 114, 990, 1002, 1014])
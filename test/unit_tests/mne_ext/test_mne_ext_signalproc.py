@@ -0,0 +1,105 @@
+# License: BSD-3
+
+import mne
+import numpy as np
+import pytest
+from scipy.ndimage import uniform_filter1d
+from scipy.signal import resample_poly
+
+from braindecode.datautil.signalproc import CausalButterworthFilter
+from braindecode.mne_ext.signalproc import (
+    ContextFunction, ResampleFunction, _resample_poly_in_chunks,
+    common_average_reference_cnt, mne_apply, mne_apply_chunked, resample_cnt)
+
+
+@pytest.fixture
+def raw():
+    rng = np.random.RandomState(0)
+    info = mne.create_info(["C3", "Cz", "C4"], sfreq=100, ch_types="eeg")
+    return mne.io.RawArray(rng.randn(3, 1003), info, verbose="error")
+
+
+def _moving_average(a):
+    return uniform_filter1d(a, size=11, axis=1, mode="nearest")
+
+
+@pytest.mark.parametrize("chunk_size,n_context", [(100, 5), (3, 5), (5000, 7)])
+def test_mne_apply_chunked(raw, tmpdir, chunk_size, n_context):
+    def car(a):
+        return a - np.mean(a, axis=0, keepdims=True)
+
+    expected = common_average_reference_cnt(raw)
+    expected = mne_apply(
+        lambda a: CausalButterworthFilter(4, 20, 100, axis=1)(a), expected)
+    expected = mne_apply(_moving_average, expected)
+    out_path = str(tmpdir.join("data.npy"))
+    transformed = mne_apply_chunked(
+        [car, CausalButterworthFilter(4, 20, 100, axis=1),
+         ContextFunction(_moving_average, n_context)],
+        raw, chunk_size=chunk_size, out_path=out_path)
+    assert isinstance(transformed._data, np.memmap)
+    np.testing.assert_allclose(transformed.get_data(), expected.get_data(),
+                               rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(np.load(out_path), expected.get_data(),
+                               rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("up,down,chunk_size", [
+    (2, 5, 100), (1, 2, 33), (5, 4, 7), (2, 5, 100000)])
+def test_resample_poly_in_chunks(up, down, chunk_size):
+    rng = np.random.RandomState(0)
+    data = rng.randn(3, 1003)
+    resampled = _resample_poly_in_chunks(
+        lambda i_start, i_stop: data[:, i_start:i_stop], 3, 1003, up, down,
+        chunk_size, n_jobs=2)
+    np.testing.assert_array_equal(
+        resampled, resample_poly(data.astype(np.float32), up, down, axis=1))
+
+
+@pytest.mark.parametrize("new_fs,up,down,chunk_size", [
+    (40, 2, 5, 100), (50, 1, 2, 1), (125, 5, 4, 7), (40, 2, 5, 5000)])
+def test_resample_function(raw, new_fs, up, down, chunk_size):
+    data = raw.get_data()
+    chunks = (data[:, i_start:i_start + chunk_size]
+              for i_start in range(0, data.shape[1], chunk_size))
+    resample = ResampleFunction(new_fs)
+    resampled = np.concatenate(
+        list(resample.apply_to_chunks(chunks, 100)), axis=1)
+    expected = resample_poly(data.astype(np.float32), up, down, axis=1)
+    assert resample.n_resampled_times(data.shape[1], 100) == expected.shape[1]
+    np.testing.assert_array_equal(resampled, expected)
+
+
+def test_mne_apply_chunked_resample(raw, tmpdir):
+    def car(a):
+        return a - np.mean(a, axis=0, keepdims=True)
+
+    expected = resample_cnt(mne_apply(car, raw), 40)
+    expected = mne_apply(_moving_average, expected)
+    out_path = str(tmpdir.join("data.npy"))
+    transformed = mne_apply_chunked(
+        [car, ResampleFunction(40), ContextFunction(_moving_average, 5)],
+        raw, chunk_size=100, out_path=out_path)
+    assert transformed.info["sfreq"] == 40
+    assert raw.info["sfreq"] == 100
+    assert transformed.n_times == 402
+    np.testing.assert_allclose(transformed.get_data(), expected.get_data(),
+                               rtol=1e-12, atol=1e-12)
+
+
+def test_resample_poly_in_chunks_accuracy():
+    resampy = pytest.importorskip("resampy")
+    freqs = np.array([[1], [10], [40], [90]])
+    data = np.sin(2 * np.pi * freqs * np.arange(5000) / 500)
+    expected = np.sin(2 * np.pi * freqs * np.arange(2500) / 250)
+    resampled = _resample_poly_in_chunks(
+        lambda i_start, i_stop: data[:, i_start:i_stop], 4, 5000, 1, 2,
+        1000, n_jobs=1)
+    resampy_resampled = resampy.resample(
+        data, 500, 250, axis=1, filter="kaiser_fast")
+    # compare away from the edges of the signal
+    np.testing.assert_allclose(
+        resampled[:, 100:-100], expected[:, 100:-100], rtol=0, atol=2e-3)
+    np.testing.assert_allclose(
+        resampled[:, 100:-100], resampy_resampled[:, 100:-100], rtol=0,
+        atol=2e-3)
@@ -0,0 +1,29 @@
+# License: BSD-3
+
+import numpy as np
+import pytest
+from numpy.random import RandomState
+
+from braindecode.util import get_balanced_batches
+
+
+@pytest.mark.parametrize("n_trials,batch_size", [(10, 3), (7, 7), (3, 10)])
+def test_get_balanced_batches(n_trials, batch_size):
+    batches = get_balanced_batches(
+        n_trials, RandomState(0), shuffle=True, batch_size=batch_size)
+    expected_inds = np.arange(n_trials)
+    RandomState(0).shuffle(expected_inds)
+    np.testing.assert_array_equal(np.concatenate(batches), expected_inds)
+    sizes = [len(batch) for batch in batches]
+    assert sorted(sizes, reverse=True) == sizes
+    assert max(sizes) - min(sizes) <= 1
+    assert len(batches) == max(int(np.round(n_trials / batch_size)), 1)
+    # batches are views of one array of all indices
+    assert all(batch.base is batches[0].base for batch in batches)
+
+    lazy_batches = get_balanced_batches(
+        n_trials, RandomState(0), shuffle=True, batch_size=batch_size,
+        lazy=True)
+    assert not isinstance(lazy_batches, list)
+    for batch, lazy_batch in zip(batches, lazy_batches):
+        np.testing.assert_array_equal(batch, lazy_batch)